@@ -21,13 +21,17 @@ if sys.platform == 'darwin':
 else:
   SIRIL_PATH = 'siril-cli'
 
-def extract_and_convert_coordinates_astap(output):
-    # Define the regex pattern, to match output like this:
-    # Solution found: 05: 36 03.8	-05° 27 14
-    regex = r"Solution found: ([0-9]+): ([0-9]+) ([0-9]+\.[0-9]+)\t([+-])([0-9]+)° ([0-9]+) ([0-9]+)"
+# Output patterns, compiled once since they are matched for every image.
+# ASTAP: "Solution found: 05: 36 03.8	-05° 27 14"
+ASTAP_SOLUTION_REGEX = re.compile(r"Solution found: ([0-9]+): ([0-9]+) ([0-9]+\.[0-9]+)\t([+-])([0-9]+)° ([0-9]+) ([0-9]+)")
+SIRIL_CENTER_REGEX = re.compile(r"Image center: alpha: ([0-9]+) ([0-9]+) ([0-9\.]+), delta: ([+-])([0-9]+) ([0-9]+) ([0-9\.]+)")
+SIRIL_ANGLE_REGEX = re.compile(r"Up is ([+-]?[0-9]+\.[0-9]+) deg CounterclockWise wrt. N")
+SIRIL_FINDSTAR_REGEX = re.compile(r"Found ([0-9]+) Gaussian profile stars in image, channel #[0-2] \(FWHM ([0-9]+\.[0-9]+)\)")
+DATE_OBS_REGEX = re.compile(r'([0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}\.[0-9]+)')
 
-    # Search for the pattern in the output
-    match = re.search(regex, output)
+def extract_and_convert_coordinates_astap(output):
+    # Search for the solution in the output
+    match = ASTAP_SOLUTION_REGEX.search(output)
     if not match:
         print("No match found")
         return None, None
@@ -46,11 +50,8 @@ def extract_and_convert_coordinates_astap(output):
     return alpha, delta
 
 def extract_and_convert_coordinates_siril(output):
-    # Define the regex pattern
-    regex = r"Image center: alpha: ([0-9]+) ([0-9]+) ([0-9\.]+), delta: ([+-])([0-9]+) ([0-9]+) ([0-9\.]+)"
-
-    # Search for the pattern in the output
-    match = re.search(regex, output)
+    # Search for the image center in the output
+    match = SIRIL_CENTER_REGEX.search(output)
     if not match:
         print("No match found")
         return None, None, None
@@ -68,8 +69,7 @@ def extract_and_convert_coordinates_siril(output):
 
     # Now find the angle, it will be in the folloing format:
     # "Up is +359.40 deg CounterclockWise wrt. N"
-    regex = r"Up is ([+-]?[0-9]+\.[0-9]+) deg CounterclockWise wrt. N"
-    match = re.search(regex, output)
+    match = SIRIL_ANGLE_REGEX.search(output)
     if not match:
         print("No match found for angle")
         return alpha, delta, None
@@ -127,9 +127,8 @@ close
                                     check=False)
             # Extract the number of stars detected, and the FWHM. Sample output:
             # Found 343 Gaussian profile stars in image, channel #1 (FWHM 5.428217)
-            regex = r"Found ([0-9]+) Gaussian profile stars in image, channel #[0-2] \(FWHM ([0-9]+\.[0-9]+)\)"
             # print(result.stdout)
-            match = re.search(regex, result.stdout)
+            match = SIRIL_FINDSTAR_REGEX.search(result.stdout)
             if not match:
                 print("No stars found")
                 print(result.stdout)
@@ -202,8 +201,7 @@ def get_fits_image_capture_time(image_file):
         output = output.decode('utf-8')
         date_part = output.split('=')[1].strip()
         # Extract only the date and time part, and convert to a datetime object.
-        re2 = re.compile(r'([0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}\.[0-9]+)')
-        date_part = re2.search(date_part).group(1)
+        date_part = DATE_OBS_REGEX.search(date_part).group(1)
         result = datetime.datetime.strptime(date_part, '%Y-%m-%dT%H:%M:%S.%f')
     except Exception as e:
         print(f"Error parsing date: {e}\n Output: {output}\n Command: {command}")
@@ -4,7 +4,15 @@
 # then creates a csv file with the astrophotography session information based on the files found.
 
 import csv
-from astropy.io import fits
+import os
+from concurrent.futures import ProcessPoolExecutor
+# Optional: fitsio reads headers in C, much faster than astropy for the many
+# small header-only reads done here.
+try:
+    import fitsio
+except ImportError:
+    fitsio = None
+    from astropy.io import fits
 from datetime import datetime, timedelta
 from tqdm import tqdm
 
@@ -78,39 +86,64 @@ def save_session_csv(sessions, output_file):
         print(session)
     return
 
+# FITS files are made of 2880 byte blocks of 80 character header cards.
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+
+def read_header(file):
+    # Read only the primary header of the file.
+    if fitsio is not None:
+        return fitsio.read_header(str(file), ext=0)
+    # Read the header blocks up to the END card, and parse just those, without
+    # building the HDU list of the file.
+    header = b''
+    with open(file, 'rb') as f:
+        while True:
+            block = f.read(FITS_BLOCK_SIZE)
+            if not block or not block.isascii():
+                # Reached the data without an END card: let astropy read the
+                # header leniently, still without scaling the data.
+                return fits.getheader(file, 0, ignore_missing_end=True,
+                                      do_not_scale_image_data=True)
+            header += block
+            if any(block[i:i + 8] == b'END     '
+                   for i in range(0, len(block), FITS_CARD_SIZE)):
+                break
+    return fits.Header.fromstring(header.decode('ascii'))
+
+def read_session_info(file):
+    # Returns the session details of a single light frame.
+    header = read_header(file)
+    date = datetime.strptime(header['DATE-OBS'], '%Y-%m-%dT%H:%M:%S.%f').date()
+    return (date, header['FILTER'], header['EXPTIME'], header['GAIN'],
+            header['CCD-TEMP'], header['FOCUSTEM'])
+
 def get_session_data(directory):
     # List the files in the sub-directories.
     subdirs = ['L', 'R', 'G', 'B', 'H', 'O', 'S']
-    sessions = []
-    i = 0
-    progress = ['|', '/', '-', '\\']
+    files = []
     for subdir in subdirs:
         # See if the sub-directory exists.
         if not (directory / subdir).exists():
             continue
         # print(f'Processing {subdir} files.')
-        files = directory.glob(f'**/{subdir}/*.fits')
-        # Use TQDM to show a progress bar.
-        for file in files:
+        files += directory.glob(f'**/{subdir}/*.fits')
+    sessions = []
+    progress = ['|', '/', '-', '\\']
+    # Read the headers in parallel, in chunks of files per worker to limit
+    # the inter-process communication.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        infos = executor.map(read_session_info, files, chunksize=8)
+        for i, (date, filter, duration, gain, sensorCooling, temperature) in enumerate(infos):
             print(f'\r{progress[i % 4]}', end='')
-            i += 1
-            # print(f'Processing {file}')
-            with fits.open(file) as hdul:
-                header = hdul[0].header
-                date = datetime.strptime(header['DATE-OBS'], '%Y-%m-%dT%H:%M:%S.%f').date()
-                filter = header['FILTER']
-                duration = header['EXPTIME']
-                gain = header['GAIN']
-                sensorCooling = header['CCD-TEMP']
-                temperature = header['FOCUSTEM']
-                session = Session(date, filter, duration, gain, sensorCooling,
-                                  default_values['darks'], default_values['flats'],
-                                  default_values['bias'], default_values['bortle'], temperature)
-                if session in sessions:
-                    index = sessions.index(session)
-                    sessions[index] += 1
-                else:
-                    sessions.append(session)
+            session = Session(date, filter, duration, gain, sensorCooling,
+                              default_values['darks'], default_values['flats'],
+                              default_values['bias'], default_values['bortle'], temperature)
+            if session in sessions:
+                index = sessions.index(session)
+                sessions[index] += 1
+            else:
+                sessions.append(session)
     print('\r', end='')
     sessions.sort()
     return sessions
@@ -8,6 +8,8 @@ import re
 
 SIRIL_PATH = '/Applications/Siril.app/Contents/MacOS/Siril'
 STRETCH=True
+# Output of the Siril stat command.
+STAT_REGEX = re.compile(r'Mean: ([0-9.]+), Median: ([0-9.]+), Sigma: ([0-9.]+), Min: ([0-9.]+), Max: ([0-9.]+), bgnoise: ([0-9.]+)')
 
 def get_fits_files(indir):
   input_dir = Path(indir)
@@ -147,7 +149,7 @@ stat
       print(f"stderr:\n{result.stderr}")
       sys.exit(1)
 
-    m = re.search(r'Mean: ([0-9.]+), Median: ([0-9.]+), Sigma: ([0-9.]+), Min: ([0-9.]+), Max: ([0-9.]+), bgnoise: ([0-9.]+)', result.stdout)
+    m = STAT_REGEX.search(result.stdout)
     if m:
       bg = float(m.group(2))
       bgnoise = float(m.group(3))
@@ -192,7 +194,7 @@ stat
         print(f"stdout:\n{result.stdout}")
         print(f"stderr:\n{result.stderr}")
         sys.exit(1)
-      m = re.search(r'Mean: ([0-9.]+), Median: ([0-9.]+), Sigma: ([0-9.]+), Min: ([0-9.]+), Max: ([0-9.]+), bgnoise: ([0-9.]+)', result.stdout)
+      m = STAT_REGEX.search(result.stdout)
       if m:
         mean = float(m.group(1))
         median = float(m.group(2))
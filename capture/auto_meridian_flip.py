@@ -27,7 +27,7 @@ def ReadIndi(device, propname, timeout=2):
   lines = output.splitlines()
   if len(lines) == 1:
     # Parse the output to get the property value.
-    output = output.split("=")[1].strip()
+    output = output.partition("=")[2].strip()
     return output  
   else:
     # Parse the output from each line to get all property values.
@@ -36,41 +36,42 @@ def ReadIndi(device, propname, timeout=2):
       # Get key-value pair. 
       # Example:"Star Adventurer GTi.RASTATUS.RAInitialized=Ok"
       # Key="RAInitialized" Value="Ok"
-      key = line.split("=")[0].split(".")[-1]
-      value = line.split("=")[1].strip()
-      output.append((key, value))
+      name, _, value = line.partition("=")
+      output.append((name.rpartition(".")[2], value.strip()))
     return output
 
 def get_mount_state(device):
-  ra_status = ReadIndi(device, "RASTATUS.*", 1)
-  de_status = ReadIndi(device, "DESTATUS.*", 1)
-
-  # If ra_status has ("RAGoto", "Ok"), or de_status has ("DEGoto", "Ok"), then the mount is running a goto slew.
-  goto_slew = False
-  for key, value in ra_status:
-    if key == "RAGoto" and value == "Ok":
-      goto_slew = True
-      break
-  for key, value in de_status:
-    if key == "DEGoto" and value == "Ok":
-      goto_slew = True
-      break
-  
-  # If not goto_slew, and ra_status has ('RARunning', 'Ok'), ('RAGoto', 'Busy'), and ('RAHighspeed', 'Busy'), then the mount is tracking.
-  tracking = False
-  if (not goto_slew) and \
-      ("RARunning", "Ok") in ra_status and \
-      ("RAGoto", "Busy") in ra_status and \
-      ("RAHighspeed", "Busy") in ra_status:
-    tracking = True
-
-  # If not goto_slew, not tracking, and ra_status has ('RARunning', 'Ok') or 
-  # de_status has ('DERunning', 'Ok'), then the mount is running a manual slew.
-  manual_slew = False
-  if (not goto_slew) and (not tracking) and \
-      (("RARunning", "Ok") in ra_status or \
-      ("DERunning", "Ok") in de_status):
-    manual_slew = True
+  # Read both status vectors with a single indi_getprop call, which accepts
+  # several properties, instead of one call per vector.
+  command = "indi_getprop -t 1 \"%s.RASTATUS.*\" \"%s.DESTATUS.*\"" % (device, device)
+  output = subprocess.run(command, shell=True, stdout=subprocess.PIPE).stdout.decode('utf-8')
+  ra_status = {}
+  de_status = {}
+  for line in output.splitlines():
+    # Example:"Star Adventurer GTi.DESTATUS.DEGoto=Ok"
+    name, value = line.split("=", 1)
+    vector, key = name.split(".")[-2:]
+    if vector == "RASTATUS":
+      ra_status[key] = value.strip()
+    elif vector == "DESTATUS":
+      de_status[key] = value.strip()
+
+  # If RAGoto or DEGoto is Ok, then the mount is running a goto slew.
+  goto_slew = ra_status.get("RAGoto") == "Ok" or \
+      de_status.get("DEGoto") == "Ok"
+
+  # If not goto_slew, and RARunning is Ok, RAGoto is Busy and RAHighspeed is
+  # Busy, then the mount is tracking.
+  tracking = (not goto_slew) and \
+      ra_status.get("RARunning") == "Ok" and \
+      ra_status.get("RAGoto") == "Busy" and \
+      ra_status.get("RAHighspeed") == "Busy"
+
+  # If not goto_slew, not tracking, and RARunning or DERunning is Ok, then the
+  # mount is running a manual slew.
+  manual_slew = (not goto_slew) and (not tracking) and \
+      (ra_status.get("RARunning") == "Ok" or \
+       de_status.get("DERunning") == "Ok")
 
   return manual_slew, goto_slew, tracking
 
@@ -102,9 +103,11 @@ def stop_tracking(device):
   exec(command)
 
 def get_pier_side(device):
-  if ReadIndi(device, "TELESCOPE_PIER_SIDE.PIER_WEST") == "On":
+  # Read both switches with a single indi_getprop call.
+  pier_side = dict(ReadIndi(device, "TELESCOPE_PIER_SIDE.*"))
+  if pier_side.get("PIER_WEST") == "On":
     return "West"
-  elif ReadIndi(device, "TELESCOPE_PIER_SIDE.PIER_EAST") == "On":
+  elif pier_side.get("PIER_EAST") == "On":
     return "East"
   else:
     print("Error: could not determine pier side")
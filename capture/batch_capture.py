@@ -178,7 +178,8 @@ def run_alignment(mount: IndiMount,
     phd2client.stop_guiding()
   camera.change_filter('L')
   camera.set_capture_settings(mode=5, gain=70, offset=20, exposure=2)
-  align_to_object(mount, camera, coordinates[0], coordinates[1], args.align_threshold)
+  align_to_object(mount, camera, coordinates[0], coordinates[1], args.align_threshold,
+                  fov=args.fov)
   if phd2client is not None:
     phd2client.start_guiding()
 
@@ -204,6 +205,8 @@ def get_args():
   # Alignment and mount limit settings.
   parser.add_argument('--align-threshold', type=float,
       help='Alignment threshold in arcseconds', default=20)
+  parser.add_argument('--fov', type=float,
+      help='Field of view (image height) in degrees, passed to ASTAP as a plate solve hint')
   parser.add_argument('--min-altitude', type=float,
       help='Minimum altitude for tracking', default=0)
   parser.add_argument('--meridian-flip-angle', type=float,
@@ -6,13 +6,6 @@ import argparse
 import sys
 import shutil
 import logging
-from astroquery.simbad import Simbad 
-from astropy.coordinates import SkyCoord
-from astropy.coordinates import FK5
-from astropy.coordinates import ICRS
-import astropy.units as units
-from astropy.coordinates import GCRS
-import astropy.time
 import math
 import time
 import os
@@ -44,6 +37,10 @@ def main():
             help='ISO value', default=3200)
   parser.add_argument('-s', '--shutter_speed', type=int, 
             help='Shutter speed in seconds', default=2)
+  parser.add_argument('--fov', type=float,
+            help='Field of view (image height) in degrees, passed to ASTAP as a plate solve hint')
+  parser.add_argument('--no-cache', action='store_true',
+            help='Always query Simbad, bypassing the on-disk object cache')
   
   args = parser.parse_args()
   ra_target, dec_target = parse_coordinates(args, parser)
@@ -58,7 +55,8 @@ def main():
   align_to_object(mount, 
                   camera, 
                   ra_target, dec_target, 
-                  args.threshold)
+                  args.threshold,
+                  fov=args.fov)
   
 
 if __name__ == '__main__':
@@ -1,13 +1,31 @@
 #!/usr/bin/env python3
 import subprocess
-import re
+import os
 import argparse
 import sys
-import time
+import tempfile
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.dirname(script_dir)
+sys.path.append(parent_dir)
+
+from sky_scripter.lib_indi import IndiMount
+
+# Optional: with rawpy installed, the RAW capture is converted to a smaller
+# FITS file before plate solving, so that ASTAP does not decode the RAW file.
+try:
+    import rawpy
+    from astropy.io import fits
+except ImportError:
+    rawpy = None
 
 iso = 3200
 shutter_speed = 2
 
+# Keep captured frames in RAM where available, to avoid writing them to slow
+# storage such as SD cards on single-board computers.
+RAM_DIR = '/dev/shm' if os.access('/dev/shm', os.W_OK) else tempfile.gettempdir()
+
 def exec(command):
     # print(command)
     # Execute the command, and check the return code.
@@ -16,108 +34,83 @@ def exec(command):
         print("Error: command '%s' returned %d" % (command, returncode))
         sys.exit(1)
 
-def exec_shell(command):
-    # print(command)
-    # Execute the command, and check the return code.
-    returncode = subprocess.call(command, shell=True)
-    if returncode != 0:
-        print("Error: command '%s' returned %d" % (command, returncode))
-        sys.exit(1)
-       
-
-def capture_image():
+def capture_image(filename):
     global iso, shutter_speed
     # print(f'Capturing image with iso={iso}, shutter_speed={shutter_speed}')
-    # Capture in desired iso, aperture, and shutter speed, pipe output to /dev/null.
+    # Set the camera to manual mode and RAW, and capture in desired iso and
+    # shutter speed, all in a single gphoto2 invocation. Pipe output to
+    # /dev/null.
     exec(['gphoto2',
-          '--set-config', f'iso={iso}',
+          '--set-config', '/main/capturesettings/autoexposuremodedial=Manual',
           '--set-config', '/main/imgsettings/imageformat=RAW',
+          '--set-config', f'iso={iso}',
           '--set-config', f'shutterspeed={shutter_speed}',
           '--capture-image-and-download',
-          '--filename', 'tmp.cr3',
+          '--filename', filename,
           '--force-overwrite'])
 
-def setup_camera():
-    # Set the camera to JPEG mode
-    exec(['gphoto2', '--set-config', '/main/imgsettings/imageformat=0'])
-    # Set the camera to manual mode
-    exec(['gphoto2', '--set-config', '/main/capturesettings/autoexposuremodedial=Manual'])
-
-def extract_and_convert_coordinates_astap(output):
-    # Define the regex pattern, to match output like this:
-    # Solution found: 05: 36 03.8	-05° 27 14
-    regex = r"Solution found: ([0-9]+): ([0-9]+) ([0-9]+\.[0-9]+)\t([+-])([0-9]+)° ([0-9]+) ([0-9]+)"
-
-    # Search for the pattern in the output
-    match = re.search(regex, output)
-    if not match:
-        print("No match found")
+def read_astap_solution(solution_file):
+    # ASTAP writes its result next to the image as <name>.ini, with lines like
+    # PLTSOLVD=T, CRVAL1=<RA in degrees>, CRVAL2=<DEC in degrees>.
+    if not os.path.exists(solution_file):
         return None, None
+    values = {}
+    with open(solution_file) as f:
+        for line in f:
+            key, _, value = line.partition('=')
+            values[key.strip()] = value.strip()
+    if values.get('PLTSOLVD') != 'T' or \
+            'CRVAL1' not in values or 'CRVAL2' not in values:
+        print("No solution found")
+        return None, None
+    # Convert RA from degrees to hours.
+    return float(values['CRVAL1']) / 15, float(values['CRVAL2'])
 
-    # Extract matched groups
-    alpha_h, alpha_m, alpha_s, delta_sign, delta_d, delta_m, delta_s = match.groups()
-    # print(f"RA: {alpha_h}h{alpha_m}m{alpha_s}s, DEC: {delta_sign}{delta_d}°{delta_m}'{delta_s}")
-
-    # Convert alpha (RA) to decimal degrees
-    alpha = float(alpha_h) + float(alpha_m)/60 + float(alpha_s)/3600
-
-    # Convert delta (DEC) to decimal degrees
-    delta_multiplier = 1 if delta_sign == '+' else -1
-    delta = delta_multiplier * (float(delta_d) + float(delta_m)/60 + float(delta_s)/3600)
-
-    return alpha, delta
+def raw_to_fits(raw_file, fits_file):
+    # Keep a single CFA channel, at half the sensor resolution. This is enough
+    # for plate solving, and much smaller than the full debayered image.
+    with rawpy.imread(raw_file) as raw:
+        data = raw.raw_image_visible[::2, ::2].astype('<f4')
+    fits.PrimaryHDU(data).writeto(fits_file, overwrite=True)
 
 def run_plate_solve_astap(file, wcs_coords, focal_option):
     ASTAP_PATH = 'astap'
     astap_cli_command = [ASTAP_PATH, "-f", file]
-    try:
-        result = subprocess.run(astap_cli_command, 
-                                text=True, 
-                                capture_output=True,
-                                check=True)
-        print(result.stdout)
-        print(result.stderr)
-        ra, dec = extract_and_convert_coordinates_astap(result.stdout)
-        return ra, dec
-    except subprocess.CalledProcessError as e:
+    base = os.path.splitext(file)[0]
+    for ext in ('.ini', '.wcs'):
+        if os.path.exists(base + ext):
+            os.remove(base + ext)
+    # Let ASTAP print directly to the console.
+    subprocess.run(astap_cli_command)
+    # ASTAP writes the .wcs file only when the solve succeeds.
+    if not os.path.exists(base + '.wcs'):
         return None, None
+    return read_astap_solution(base + '.ini')
 
-def set_tracking(device):
-    exec_shell("indi_setprop \"%s.TELESCOPE_TRACK_STATE.TRACK_ON=On\"" % device)
-
-def ReadIndi(device, propname):
-  # Call indi_getprop to get the property value
-  command = "indi_getprop \"%s.%s\"" % (device, propname)
-  # Execute the command and get the output.
-  output = subprocess.run(command, shell=True, stdout=subprocess.PIPE).stdout.decode('utf-8')
-  # Parse the output to get the property value.
-  output = output.split("=")[1].strip()
-  return output
-
-def verify_sync(device, ra_expected, dec_expected):
-    ra = float(ReadIndi(device, "EQUATORIAL_EOD_COORD.RA"))
-    dec = float(ReadIndi(device, "EQUATORIAL_EOD_COORD.DEC"))
+def verify_sync(mount, ra_expected, dec_expected):
+    ra, dec = mount.get_ra_dec()
     if abs(ra - ra_expected) > 0.001 or abs(dec - dec_expected) > 0.001:
         print("ERROR: Sync failed")
         sys.exit(1)
-    
-def sync(device, ra, dec):
-    exec_shell("indi_setprop \"%s.TELESCOPE_TRACK_STATE.TRACK_ON=On\"" % device)
-    exec_shell("indi_setprop \"%s.ON_COORD_SET.SYNC=On\"" % device)
-    exec_shell("indi_setprop \"%s.EQUATORIAL_EOD_COORD.RA=%f;DEC=%f\"" % (device, ra, dec))
 
 def main():
     parser = argparse.ArgumentParser(description='Capture and plate solve an image, then sync the mount')
     parser.add_argument('-d', '--device', type=str, help='INDI device name', default='Star Adventurer GTi')
     args = parser.parse_args()
+    mount = IndiMount(args.device)
 
     print("Set tracking...")
-    set_tracking(args.device)
+    mount.start_tracking()
     print("Capturing image...")
-    setup_camera()
-    capture_image()
-    print('Running plate solve...')
-    ra, dec = run_plate_solve_astap('tmp.cr3', None, None)
+    with tempfile.TemporaryDirectory(dir=RAM_DIR) as tmpdirname:
+        image_file = os.path.join(tmpdirname, 'tmp.cr3')
+        capture_image(image_file)
+        if rawpy is not None:
+            fits_file = os.path.join(tmpdirname, 'tmp.fits')
+            raw_to_fits(image_file, fits_file)
+            image_file = fits_file
+        print('Running plate solve...')
+        ra, dec = run_plate_solve_astap(image_file, None, None)
     # ra = 2
     # dec = 89
     if ra is None or dec is None:
@@ -125,11 +118,9 @@ def main():
         sys.exit(1)
     print(f'RA: {ra}, DEC: {dec}')
     print('Syncing mount...')
-    time.sleep(2)
-    sync(args.device, ra, dec)
+    mount.sync(ra, dec)
     print('Verifying sync...')
-    time.sleep(2)
-    verify_sync(args.device, ra, dec)
+    verify_sync(mount, ra, dec)
     print('Done.')
 
 if __name__ == '__main__':
@@ -1,126 +1,55 @@
+#!/usr/bin/env python3
 import subprocess
 import cv2
 import os
-import numpy as np
 import platform
+import sys
+
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.dirname(script_dir)
+sys.path.append(parent_dir)
+
+from sky_scripter.focus import display_image_bytes, zoom_image, \
+    init_interactive_opencv
 
 KEY_MAP = {
     'left': 2,
     'right': 3
 }
 
-def find_star(image):
-    # Convert to grayscale and normalize
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    gray = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX)
-
-    # Apply a blur to reduce noise
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-
-    # Find the brightest point
-    (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(blurred)
-    return maxLoc, maxVal
-
-
-def compute_fwhm(image, star_location, max_val):
-    x, y = star_location
-    row = image[y, :]
-    max_intensity = max_val
-
-    # Find the half max value
-    half_max = max_intensity / 2
-
-    # print(f'Max intensity: {max_intensity:9.3f}')
-    # print(f'x: {x}, y: {y}')
-    left_crossings = np.where(row[:x] < half_max)[0]
-    right_crossings = np.where(row[x:] < half_max)[0]
-    # Check if crossings are found
-    if left_crossings.size > 0 and right_crossings.size > 0:
-        left_idx = left_crossings[-1]
-        right_idx = x + right_crossings[0]
-        fwhm = right_idx - left_idx
-        return fwhm
-    else:
-        # Handle case where FWHM cannot be computed
-        return None
+# Camera settings last written by gphoto2, to skip re-sending unchanged values.
+applied_settings = {}
 
 def capture_image():
     global iso, shutter_speed
     # print(f'Capturing image with iso={iso}, shutter_speed={shutter_speed}')
-    # Capture in desired iso, aperture, and shutter speed, pipe output to /dev/null.
-    result = subprocess.run(['gphoto2',
-                              '--set-config', f'iso={iso}',
-                              '--set-config', f'shutterspeed={shutter_speed}',
-                              '--capture-image-and-download',
-                              '--filename', 'tmp.jpg',
-                              '--force-overwrite'], stdout=subprocess.DEVNULL)
+    # Only pass the settings that changed since the last capture.
+    settings = {'iso': iso, 'shutterspeed': shutter_speed}
+    command = ['gphoto2']
+    for key, value in settings.items():
+        if applied_settings.get(key) != value:
+            command += ['--set-config', f'{key}={value}']
+    # Capture in desired iso, aperture, and shutter speed, and read the image
+    # from stdout instead of writing it to disk.
+    result = subprocess.run(command + ['--capture-image-and-download',
+                                       '--stdout'],
+                            stdout=subprocess.PIPE)
     if result.returncode != 0:
         print("Error capturing image.")
         exit(1)
-
-def display_image(window_name, image_path):
-    image = cv2.imread(image_path)
-    # image_scaled = cv2.resize(image, (0, 0), fx=0.15, fy=0.15)
-    cv2.imshow(window_name, image)
-    # Resize the window to fit the screen.
-    cv2.resizeWindow(window_name, 1500, 1000)
-    return image
+    applied_settings.update(settings)
+    return result.stdout
 
 def update_images():
     global main_image, zoom_location, main_window_name
-    capture_image()
-    main_image = display_image(main_window_name, 'tmp.jpg')
+    main_image = display_image_bytes(main_window_name, capture_image())
     update_zoomed_image(zoom_location[0], zoom_location[1])
 
 def update_zoomed_image(x, y):
     global main_image, zoom_window_name, zoom_factor
-    zoomed_image = zoom_image(main_image, (x, y), zoom_factor=zoom_factor)
+    zoomed_image, _, _ = zoom_image(main_image, (x, y), zoom_factor=zoom_factor)
     cv2.imshow(zoom_window_name, zoomed_image)
 
-def zoom_image(image, click_point, zoom_factor=8, window_size=(400, 400)):
-    # Calculate the zoomed area dimensions
-    x, y = click_point
-    width, height = image.shape[1], image.shape[0]
-    zoom_width, zoom_height = window_size[0] // zoom_factor, window_size[1] // zoom_factor
-    
-    # Define the ROI
-    x1 = max(x - zoom_width // 2, 0)
-    y1 = max(y - zoom_height // 2, 0)
-    x2 = min(x1 + zoom_width, width)
-    y2 = min(y1 + zoom_height, height)
-    
-    # Crop and resize the image
-    zoomed_img = image[y1:y2, x1:x2]
-    # Compute sum of laplacian to check if the image is blurry
-    laplacian = cv2.Laplacian(zoomed_img, cv2.CV_64F).var()
-    # Print the laplacian value in format %9.3f
-    zoomed_img = cv2.resize(zoomed_img, window_size, interpolation=cv2.INTER_NEAREST)
-
-    # Star detection
-    star_location, max_val = find_star(zoomed_img)
-
-    # Compute FWHM
-    fwhm = compute_fwhm(zoomed_img, star_location, max_val)
-
-    # Draw a crosshair and circle around the star
-    cv2.drawMarker(zoomed_img, star_location, (0, 0, 255), cv2.MARKER_CROSS, 10, 2)
-    if fwhm:
-      cv2.circle(zoomed_img, star_location, fwhm // 2, (0, 0, 255), 2)
-
-    # Overlay the laplacian and FWHM values on the image, and a black box behind it.
-    cv2.rectangle(zoomed_img, (0, 0), (300, 25), (0, 0, 0), -1)
-    cv2.putText(zoomed_img, f'Laplacian: {laplacian:9.3f}', (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2, cv2.LINE_AA)
-    if fwhm:
-      fwhm = fwhm / zoom_factor
-      cv2.rectangle(zoomed_img, (0, 25), (300, 50), (0, 0, 0), -1)
-      cv2.putText(zoomed_img, f'FWHM: {fwhm:9.3f}', (10, 45), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2, cv2.LINE_AA)
-
-    if fwhm:
-      print(f'Laplacian: {laplacian:9.3f} | FWHM: {fwhm:9.3f}')
-    else:      
-      print(f'Laplacian: {laplacian:9.3f} | FWHM: None')
-    return zoomed_img
-
 def click_event(event, x, y, flags, param):
     global main_image, zoom_window_name, zoom_location
     if event == cv2.EVENT_LBUTTONDOWN:
@@ -132,10 +61,10 @@ def click_event(event, x, y, flags, param):
             zoom_location = (x, y)
 
 def setup_camera():
-    # Set the camera to JPEG mode
-    subprocess.run(['gphoto2', '--set-config', '/main/imgsettings/imageformat=0'])
-    # Set the camera to manual mode
-    subprocess.run(['gphoto2', '--set-config', '/main/capturesettings/autoexposuremodedial=Manual'])
+    # Set the camera to JPEG and manual mode in a single gphoto2 invocation.
+    subprocess.run(['gphoto2',
+                    '--set-config', '/main/imgsettings/imageformat=0',
+                    '--set-config', '/main/capturesettings/autoexposuremodedial=Manual'])
 
 def update_keymap():
     global KEY_MAP
@@ -159,6 +88,7 @@ def main():
     main_window_name = "DSLR Viewer"
     zoom_window_name = "Zoomed View"
     setup_camera()
+    init_interactive_opencv()
     update_keymap()
     cv2.namedWindow(main_window_name, cv2.WINDOW_NORMAL)
     cv2.setMouseCallback(main_window_name, click_event)
@@ -277,8 +207,6 @@ def main():
             print('Current ISO: %d' % iso)
             update_images()
 
-    # Delete the temporary image file
-    os.remove('tmp.jpg')
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
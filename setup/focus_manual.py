@@ -1,101 +1,41 @@
 #!/usr/bin/env python3
 
 import argparse
-import subprocess
+import contextlib
 import sys
-import re
-import shutil
 import os
 import tempfile
-import time
+import termios
+import tty
 script_dir = os.path.dirname(__file__)
 parent_dir = os.path.dirname(script_dir)
 sys.path.append(parent_dir)
 
-from sky_scripter.lib_indi import get_focus, adjust_focus
+from sky_scripter.lib_indi import IndiFocuser
+from sky_scripter.lib_gphoto import GphotoClient
+from sky_scripter.focus import detect_stars
 
-SIMULATE = False
-VERBOSE = False
+# Keep captured frames in RAM where available, to avoid writing them to slow
+# storage such as SD cards on single-board computers.
+RAM_DIR = '/dev/shm' if os.access('/dev/shm', os.W_OK) else tempfile.gettempdir()
 
-def setup_camera(args):
-    global SIMULATE, VERBOSE
-    if SIMULATE:
+@contextlib.contextmanager
+def single_key_input():
+    # Put the terminal in cbreak mode so that each key press is read
+    # immediately, without waiting for ENTER. The terminal settings are
+    # restored on exit, including on exceptions and CTRL-C.
+    if not sys.stdin.isatty():
+        yield
         return
-    stderr = subprocess.DEVNULL
-    if VERBOSE:
-      stderr = None
-    setttings = [
-        '/main/imgsettings/imageformat=RAW', 
-        '/main/capturesettings/autoexposuremodedial=Manual',
-        'iso=%s' % args.iso,
-        'shutterspeed=%s' % args.exposure]
-    # Set the camera to RAW, manual mode, with selected exposure time and ISO.
-    subprocess.run(['gphoto2', 
-                    '--set-config'] + setttings,
-                    stdout=subprocess.DEVNULL, stderr=stderr)
-    
-
-def capture_image(filename):
-    global SIMULATE, VERBOSE
-    if SIMULATE:
-        # Copy sample_data/NGC2244.cr3 to filename.
-        shutil.copyfile('sample_data/NGC2244.cr3', filename)
-        return
-    stderr = subprocess.DEVNULL
-    if VERBOSE:
-      stderr = None
-    result = subprocess.run(['gphoto2',
-                              '--capture-image-and-download',
-                              '--filename', filename,
-                              '--force-overwrite'], 
-                              stdout=subprocess.DEVNULL, stderr=stderr)
-    if result.returncode != 0:
-        print("Error capturing image.")
-        # exit(1)
-
-
-def run_star_detect_siril(this_dir, file):
-    # If MacOS, use the Siril.app version
-    if sys.platform == 'darwin':
-      SIRIL_PATH = '/Applications/Siril.app/Contents/MacOS/siril-cli'
-    else:
-      SIRIL_PATH = '/home/joydeepb/Siril-1.2.1-x86_64.AppImage'
-      
-    siril_commands = f"""requires 1.2.0
-convert light
-calibrate_single light_00001 -bias="=2048" -debayer -cfa -equalize_cfa 
-load pp_light_00001
-findstar
-close
-"""
-    # Define the command to run
-    siril_cli_command = [SIRIL_PATH, "-d", this_dir, "-s", "-"]
-
-    # Run the command and capture output
+    fd = sys.stdin.fileno()
+    old_settings = termios.tcgetattr(fd)
     try:
-        result = subprocess.run(siril_cli_command, 
-                                input=siril_commands,
-                                text=True, 
-                                capture_output=True,
-                                check=True)
-        if result.returncode != 0:
-            print("Error running Siril.")
-            exit(1)
-        # print(result.stdout)
-        # Extract the number of stars detected, and the FWHM. Sample output:
-        # Found 343 Gaussian profile stars in image, channel #0 (FWHM 5.428217)
-        regex = r"Found ([0-9]+) Gaussian profile stars in image, channel #1 \(FWHM ([0-9]+\.[0-9]+)\)"
-        match = re.search(regex, result.stdout)
-        if not match:
-            print("No match found")
-            return None, None
-        num_stars, fwhm = match.groups()
-        return int(num_stars), float(fwhm)
-    except subprocess.CalledProcessError as e:
-        return None, None
+        tty.setcbreak(fd)
+        yield
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
 
 def main():
-    global SIMULATE, VERBOSE
     parser = argparse.ArgumentParser(description='Manually focus a telescope using a camera and star FWHM detection')
 
     # Optional arguments: ISO, exposure time
@@ -111,42 +51,44 @@ def main():
                         help='Verbose output')
 
     args = parser.parse_args()
-    
-    SIMULATE = args.simulate
-    VERBOSE = args.verbose
+
+    focuser = IndiFocuser(args.device, simulate=args.simulate)
+    camera = GphotoClient('RAW',
+                          'Manual',
+                          iso=args.iso,
+                          shutter_speed=str(args.exposure),
+                          simulate=args.simulate)
     # Set up the camera
-    setup_camera(args)
-    print('Press ENTER to capture an image and analyze it, CTRL-C to quit.')
+    camera.initialize()
+    print('Press ENTER to capture an image and analyze it, [ ] , . to adjust focus, q to quit.')
     # Make a temporary directory to store the image.
     
-    with tempfile.TemporaryDirectory() as tmpdirname:
+    with tempfile.TemporaryDirectory(dir=RAM_DIR) as tmpdirname, \
+        single_key_input():
       filename = os.path.join(tmpdirname, 'tmp.cr3')
       while True:
-          user_input = input()
-          if user_input == 'q':
+          user_input = sys.stdin.read(1)
+          if user_input == 'q' or user_input == '':
               sys.exit(0)
           elif user_input == '[':
-              adjust_focus(args.device, -100)
-              print('Focus value:', get_focus(args.device))
+              focuser.adjust_focus(-100)
+              print('Focus value:', focuser.get_focus())
           elif user_input == ']':
-              adjust_focus(args.device, 100)
-              print('Focus value:', get_focus(args.device))
+              focuser.adjust_focus(100)
+              print('Focus value:', focuser.get_focus())
           elif user_input == ',':
-              adjust_focus(args.device, -10)
-              print('Focus value:', get_focus(args.device))
+              focuser.adjust_focus(-10)
+              print('Focus value:', focuser.get_focus())
           elif user_input == '.':
-              adjust_focus(args.device, 10)
-              print('Focus value:', get_focus(args.device))
+              focuser.adjust_focus(10)
+              print('Focus value:', focuser.get_focus())
           else:
               if args.verbose:
                   print('Capturing image...')
-              # Remove all files in tmpdirname.
-              for file in os.listdir(tmpdirname):
-                  os.remove(os.path.join(tmpdirname, file))
-              capture_image(filename)
+              camera.capture_image(filename)
               if args.verbose:
                   print('Analyzing image...')
-              num_stars, fwhm = run_star_detect_siril(tmpdirname, 'tmp.cr3')
+              num_stars, fwhm = detect_stars(filename)
               # Create bar graph with FWHM, ranging from 1 bar for 1.0 to 30
               # bars for 6.0, clipping to [1.0, 6.0].
               if fwhm is None:
@@ -1,12 +1,11 @@
 #!/usr/bin/env python3
-import subprocess
+import asyncio
 import cv2
+import math
 import os
-import numpy as np
 import platform
 import sys
 import argparse
-import tempfile
 
 script_dir = os.path.dirname(__file__)
 parent_dir = os.path.dirname(script_dir)
@@ -14,69 +13,35 @@ sys.path.append(parent_dir)
 
 from sky_scripter.lib_indi import IndiFocuser
 from sky_scripter.lib_gphoto import GphotoClient
+from sky_scripter.focus import display_image_bytes, zoom_image, \
+    init_interactive_opencv
 
 KEY_MAP = {
   'left': 2,
   'right': 3
 }
 
-def find_star(image):
-  # Convert to grayscale and normalize
-  gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-  gray = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX)
-  # Save grayscale image for debugging
-  cv2.imwrite('gray.jpg', gray)
-  # Find the brightest point
-  (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(gray)
-  # Find the centroid of the pixels that have the maximum value.
-  maxValPixels = np.array(np.where(gray == maxVal)).T
-  x = np.mean(maxValPixels[:, 0])
-  y = np.mean(maxValPixels[:, 1])
-  return (int(y), int(x)), maxVal
-
-  return maxLoc, maxVal
-
-
-def compute_fwhm(image, star_location, max_val):
-  x, y = star_location
-  row = image[y, :]
-  max_intensity = max_val
-  # Find the half max value
-  half_max = max_intensity / 2
-  # print(f'Max intensity: {max_intensity:9.3f}')
-  # print(f'x: {x}, y: {y}')
-  left_crossings = np.where(row[:x] < half_max)[0]
-  right_crossings = np.where(row[x:] < half_max)[0]
-  # Check if crossings are found
-  if left_crossings.size > 0 and right_crossings.size > 0:
-    left_idx = left_crossings[-1]
-    right_idx = x + right_crossings[0]
-    fwhm = right_idx - left_idx
-    return fwhm
-  else:
-    # Handle case where FWHM cannot be computed
-    return None
-
-def display_image(window_name, image_path):
-  image = cv2.imread(image_path)
-  # image_scaled = cv2.resize(image, (0, 0), fx=0.15, fy=0.15)
-  print(f'Image shape: {image.shape}')
-  cv2.imshow(window_name, image)
-  # Resize the window to fit the screen.
-  cv2.resizeWindow(window_name, 1500, 1000)
-  return image
+def capture_image_bytes(camera, iso=None):
+  # Run the capture in a worker thread, and keep pumping the OpenCV event loop
+  # so that the windows stay responsive while gphoto2 runs.
+  async def capture():
+    task = asyncio.create_task(
+        asyncio.to_thread(camera.capture_image_bytes, iso=iso))
+    while not task.done():
+      cv2.waitKey(10)
+      await asyncio.sleep(0)
+    return task.result()
+  return asyncio.run(capture())
 
 def update_images(camera):
   global main_image, zoom_location, main_window_name, iso
-  with tempfile.TemporaryDirectory() as tempdir:
-    image_file = os.path.join(tempdir, 'tmp.jpg')
-    camera.capture_image(image_file, iso=iso)
-    # Check if the image file exists.
-    if not os.path.exists(image_file):
-      print(f'Error: Image file {image_file} not found.')
-      sys.exit(1)
-    main_image = display_image(main_window_name, image_file)
-    update_zoomed_image(zoom_location[0], zoom_location[1])
+  # Decode the capture from memory, without a round trip through the disk.
+  image_bytes = capture_image_bytes(camera, iso=iso)
+  if not image_bytes:
+    print('Error: No image captured.')
+    sys.exit(1)
+  main_image = display_image_bytes(main_window_name, image_bytes)
+  update_zoomed_image(zoom_location[0], zoom_location[1])
 
 def update_zoomed_image(x, y):
   global main_image, zoom_window_name, zoom_factor
@@ -84,50 +49,6 @@ def update_zoomed_image(x, y):
   cv2.imshow(zoom_window_name, zoomed_image)
   return laplacian, fwhm
 
-def zoom_image(image, click_point, zoom_factor=8, window_size=(400, 400)):
-  # Calculate the zoomed area dimensions
-  x, y = click_point
-  width, height = image.shape[1], image.shape[0]
-  zoom_width, zoom_height = window_size[0] // zoom_factor, window_size[1] // zoom_factor
-  
-  # Define the ROI
-  x1 = max(x - zoom_width // 2, 0)
-  y1 = max(y - zoom_height // 2, 0)
-  x2 = min(x1 + zoom_width, width)
-  y2 = min(y1 + zoom_height, height)
-  
-  # Crop and resize the image
-  zoomed_img = image[y1:y2, x1:x2]
-  # Compute sum of laplacian to check if the image is blurry
-  laplacian = cv2.Laplacian(zoomed_img, cv2.CV_64F).var()
-  # Print the laplacian value in format %9.3f
-  zoomed_img = cv2.resize(zoomed_img, window_size, interpolation=cv2.INTER_NEAREST)
-
-  # Star detection
-  star_location, max_val = find_star(zoomed_img)
-
-  # Compute FWHM
-  fwhm = compute_fwhm(zoomed_img, star_location, max_val)
-
-  # Draw a crosshair and circle around the star
-  cv2.drawMarker(zoomed_img, star_location, (0, 0, 255), cv2.MARKER_CROSS, 10, 2)
-  if fwhm:
-    cv2.circle(zoomed_img, star_location, fwhm // 2, (0, 0, 255), 2)
-
-  # Overlay the laplacian and FWHM values on the image, and a black box behind it.
-  cv2.rectangle(zoomed_img, (0, 0), (300, 25), (0, 0, 0), -1)
-  cv2.putText(zoomed_img, f'Laplacian: {laplacian:9.3f}', (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2, cv2.LINE_AA)
-  if fwhm:
-    fwhm = fwhm / zoom_factor
-    cv2.rectangle(zoomed_img, (0, 25), (300, 50), (0, 0, 0), -1)
-    cv2.putText(zoomed_img, f'FWHM: {fwhm:9.3f}', (10, 45), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2, cv2.LINE_AA)
-
-  if fwhm:
-    print(f'Laplacian: {laplacian:9.3f} | FWHM: {fwhm:9.3f}')
-  else:    
-    print(f'Laplacian: {laplacian:9.3f} | FWHM: None')
-  return zoomed_img, laplacian, fwhm
-
 def click_event(event, x, y, flags, param):
   global main_image, zoom_window_name, zoom_location
   if event == cv2.EVENT_LBUTTONDOWN:
@@ -140,45 +61,61 @@ def click_event(event, x, y, flags, param):
 
 def update_keymap():
   global KEY_MAP
-  if platform.system() == 'Darwin':
+  system = platform.system()
+  if system == 'Darwin':
     KEY_MAP['left'] = 2
     KEY_MAP['right'] = 3
-  elif platform.system() == 'Linux':
+  elif system == 'Linux':
     KEY_MAP['left'] = 81
     KEY_MAP['right'] = 83
 
 def auto_focus(focuser, camera, initial_focus, step_size):
-  global main_image, zoom_location, main_window_name, iso
+  global main_image, zoom_location, main_window_name
   abs_min_focus = initial_focus - 4 * step_size
   focuser.set_focus(abs_min_focus)
-  max_laplacian = 0
+  current_focus = abs_min_focus
   min_step_size = 10
-  best_focus = initial_focus
-  with tempfile.TemporaryDirectory() as tempdir:
-    image_file = os.path.join(tempdir, 'tmp.jpg')
-    while step_size > min_step_size:
-      focuser.set_focus(abs_min_focus)
-      min_focus = best_focus - 2 * step_size
-      max_focus = best_focus + 2 * step_size
-      print(f'Focusing from {min_focus} to {max_focus} in steps of {step_size}')
-      for focus in range(min_focus, max_focus + 1, step_size):
-        focuser.set_focus(focus)
-        camera.capture_image(image_file)
-        main_image = display_image(main_window_name, image_file)
-        laplacian, fwhm = update_zoomed_image(*zoom_location)
-        cv2.waitKey(1)
-        if fwhm is None:
-          fwhm = 0
-        print(f'Focus: {focus} | Laplacian: {laplacian:9.3f} | FWHM: {fwhm:9.3f}')
-        if laplacian > max_laplacian:
-          max_laplacian = laplacian
-          best_focus = focus
-      step_size = step_size // 2
-    print(f'Best focus: {best_focus} | Max Laplacian: {max_laplacian:9.3f}')
-    focuser.set_focus(abs_min_focus)
-    focuser.set_focus(best_focus)
-    camera.capture_image(image_file)
-    main_image = display_image(main_window_name, image_file)
+  laplacians = {}
+  def measure(focus):
+    global main_image
+    nonlocal current_focus
+    focus = int(round(focus))
+    # Each capture takes seconds, so never capture the same position twice.
+    if focus not in laplacians:
+      # Always approach the focus position from below, to take up backlash.
+      if focus < current_focus:
+        focuser.set_focus(abs_min_focus)
+      focuser.set_focus(focus)
+      current_focus = focus
+      main_image = display_image_bytes(main_window_name,
+                                       capture_image_bytes(camera))
+      laplacian, fwhm = update_zoomed_image(*zoom_location)
+      cv2.waitKey(1)
+      if fwhm is None:
+        fwhm = 0
+      print(f'Focus: {focus} | Laplacian: {laplacian:9.3f} | FWHM: {fwhm:9.3f}')
+      laplacians[focus] = laplacian
+    return laplacians[focus]
+
+  # The Laplacian variance is unimodal near best focus: find its maximum with
+  # a golden-section search, which needs far fewer captures than a sweep.
+  phi = (1 + math.sqrt(5)) / 2
+  low, high = initial_focus - 2 * step_size, initial_focus + 2 * step_size
+  print(f'Focusing from {low} to {high}')
+  while high - low > min_step_size:
+    c = high - (high - low) / phi
+    d = low + (high - low) / phi
+    if measure(c) > measure(d):
+      high = d
+    else:
+      low = c
+  best_focus = max(laplacians, key=laplacians.get)
+  max_laplacian = laplacians[best_focus]
+  print(f'Best focus: {best_focus} | Max Laplacian: {max_laplacian:9.3f}')
+  focuser.set_focus(abs_min_focus)
+  focuser.set_focus(best_focus)
+  main_image = display_image_bytes(main_window_name,
+                                   capture_image_bytes(camera))
   laplacian, fwhm = update_zoomed_image(*zoom_location)
   if fwhm is None:
     fwhm = 0
@@ -214,6 +151,7 @@ def main():
   main_window_name = "DSLR Viewer"
   zoom_window_name = "Zoomed View"
 
+  init_interactive_opencv()
   update_keymap()
   cv2.namedWindow(main_window_name, cv2.WINDOW_NORMAL)
   cv2.setMouseCallback(main_window_name, click_event)
@@ -246,102 +184,64 @@ def main():
   
   print('Current focus: %d' % focuser.get_focus())
   
+  def adjust_focus(steps):
+    focuser.adjust_focus(steps)
+    update_images(camera)
+
+  def pan(dx, dy):
+    global zoom_location
+    zoom_location = (zoom_location[0] + dx, zoom_location[1] + dy)
+    update_zoomed_image(*zoom_location)
+
+  def zoom(factor):
+    global zoom_factor
+    if 1 <= zoom_factor * factor <= 64:
+      zoom_factor = int(zoom_factor * factor)
+    update_zoomed_image(*zoom_location)
+
+  def set_iso(factor):
+    global iso
+    if 100 <= iso * factor <= 51200:
+      iso = int(iso * factor)
+    print('Current ISO: %d' % iso)
+    update_images(camera)
+
+  def run_auto_focus():
+    initial_focus = focuser.get_focus()
+    step_size = 100
+    auto_focus(focuser, camera, initial_focus, step_size)
+
+  # Dispatch table from key code to handler.
+  handlers = {
+    32: lambda: update_images(camera),   # Spacebar: capture
+    KEY_MAP['left']: lambda: adjust_focus(5),
+    KEY_MAP['right']: lambda: adjust_focus(-5),
+    91: lambda: adjust_focus(200),       # "[" key
+    93: lambda: adjust_focus(-200),      # "]" key
+    46: lambda: adjust_focus(50),        # "." key
+    44: lambda: adjust_focus(-50),       # "," key
+    97: lambda: pan(-10, 0),             # a key: pan left
+    100: lambda: pan(10, 0),             # d key: pan right
+    119: lambda: pan(0, -10),            # w key: pan up
+    115: lambda: pan(0, 10),             # s key: pan down
+    113: lambda: zoom(0.5),              # q key: zoom in
+    101: lambda: zoom(2),                # e key: zoom out
+    122: lambda: set_iso(0.5),           # z key: decrease ISO
+    120: lambda: set_iso(2),             # x key: increase ISO
+    102: run_auto_focus,                 # f key: auto focus
+  }
+
   while True:
     key = cv2.waitKey(1)
-    # if key > 0:
-    #   print(key)
-    if key == 32:  # Spacebar key code
-      update_images(camera)
-
+    # Most ticks have no key press.
+    if key < 0:
+      continue
     if key == 27:  # ESC key to exit
       break
-
-    # Left key: focus closer +1
-    if key == KEY_MAP['left']:
-      focuser.adjust_focus(5)
-      update_images(camera)
-    
-    # Right key: focus further -1
-    if key == KEY_MAP['right']:
-      focuser.adjust_focus(-5)
-      update_images(camera)
-
-    # "[" key: focus closer +3
-    if key == 91:
-      focuser.adjust_focus(200)
-      update_images(camera)
-
-    # "]" key: focus further -3
-    if key == 93:
-      focuser.adjust_focus(-200)
-      update_images(camera)
-
-    # "." key: focus closer +2
-    if key == 46:
-      focuser.adjust_focus(50)
-      update_images(camera)
-
-    # "," key: focus further -2
-    if key == 44:
-      focuser.adjust_focus(-50)
-      update_images(camera)
-
-    # Pan left
-    if key == 97: # a key
-      zoom_location = (zoom_location[0] - 10, zoom_location[1])
-      update_zoomed_image(*zoom_location)
-
-    # Pan right
-    if key == 100: # d key
-      zoom_location = (zoom_location[0] + 10, zoom_location[1])
-      update_zoomed_image(*zoom_location)
-
-    # Pan up
-    if key == 119: # w key
-      zoom_location = (zoom_location[0], zoom_location[1] - 10)
-      update_zoomed_image(*zoom_location)
-
-    # Pan down
-    if key == 115: # s key
-      zoom_location = (zoom_location[0], zoom_location[1] + 10)
-      update_zoomed_image(*zoom_location)
-
-    # "q" key: zoom in
-    if key == 113:
-      if zoom_factor > 1:
-        zoom_factor = zoom_factor // 2
-      # print(f'Zoom factor: {zoom_factor}')
-      update_zoomed_image(*zoom_location)
-
-    # "e" key: zoom out
-    if key == 101:
-      if zoom_factor < 64:
-        zoom_factor = zoom_factor * 2
-      # print(f'Zoom factor: {zoom_factor}')
-      update_zoomed_image(*zoom_location)
-
-    # "z" key: Decrease ISO
-    if key == 122:
-      if iso > 100:
-        iso = iso // 2
-      print('Current ISO: %d' % iso)
-      update_images(camera)
-
-    # "x" key: Increase ISO
-    if key == 120:
-      if iso < 51200:
-        iso = iso * 2
-      print('Current ISO: %d' % iso)
-      update_images(camera)
-
-    # "f" key: Auto focus
-    if key == 102:
-      initial_focus = focuser.get_focus()
-      step_size = 100
-      auto_focus(focuser, camera, initial_focus, step_size)
-    
-    if key > 0:
-      print('Current focus: %d' % focuser.get_focus())
+    handler = handlers.get(key)
+    if handler is not None:
+      handler()
+    print('Current focus: %d' % focuser.get_focus())
 
   cv2.destroyAllWindows()
 
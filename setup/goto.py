@@ -1,15 +1,8 @@
 #!/usr/bin/env python3
 
-from astroquery.simbad import Simbad 
-from astropy.coordinates import SkyCoord
-from astropy.coordinates import FK5
-from astropy.coordinates import ICRS
-import astropy.units as units
-from astropy.coordinates import GCRS
 import sys
 import os
 import subprocess
-import astropy.time
 import argparse
 import logging
 
@@ -18,7 +11,8 @@ parent_dir = os.path.dirname(script_dir)
 sys.path.append(parent_dir)
 
 from sky_scripter.lib_indi import IndiMount
-from sky_scripter.util import init_logging, lookup_object_coordinates
+from sky_scripter.util import init_logging, lookup_object_coordinates, \
+    parse_sexagesimal, format_sexagesimal
  
 # def get_wcs_coordinates(object_name):
 #     # Query the object
@@ -43,6 +37,7 @@ def main():
   parser.add_argument('-o', '--object', type=str, help='Astronomical object name, either a catalog name (e.g., "M31") or a common name (e.g., "Andromeda Galaxy")')
   parser.add_argument('-w', '--wcs', type=str, help='WCS coordinates (e.g., "5:35:17 -5:23:24")')
   parser.add_argument('-d', '--device', type=str, help='INDI device name', default='Star Adventurer GTi')
+  parser.add_argument('--no-cache', action='store_true', help='Always query Simbad, bypassing the on-disk object cache')
 
   args = parser.parse_args()
   mount = IndiMount(args.device)
@@ -56,24 +51,20 @@ def main():
     parser.print_help()
     sys.exit(1)
   if args.object is not None:
-      coordinates = lookup_object_coordinates(args.object)
+      coordinates = lookup_object_coordinates(args.object,
+                                              use_cache=not args.no_cache)
       print(f"Using FK5(equinox=now) coordinates of '{args.object}': {coordinates}")
       logging.info(f"Using FK5(equinox=now) coordinates of '{args.object}': {coordinates}")
   else:
-      coordinates = args.wcs.split()
-      # Convert coordinates to RA and DEC in decimal degrees.
-      ra, dec = coordinates
-      c = SkyCoord(ra, dec, unit=(units.hour, units.deg))
-      coordinates = c.ra.hour, c.dec.deg
+      # Convert coordinates to RA in decimal hours and DEC in decimal degrees.
+      ra, dec = args.wcs.split()
+      coordinates = parse_sexagesimal(ra), parse_sexagesimal(dec)
       print(f"Using given coordinates: {coordinates}")
       logging.info(f"Using given coordinates: {coordinates}")
 
   # Print the RA, DEC in HH:MM:SS, DD:MM:SS format.
-  c = SkyCoord(coordinates[0], coordinates[1],
-               unit=(units.hourangle, units.deg))
   log_message = "GoTo RA %s, DEC %s" % \
-      (c.ra.to_string(unit=units.hour, sep=':'),
-       c.dec.to_string(unit=units.degree, sep=':'))
+      (format_sexagesimal(coordinates[0]), format_sexagesimal(coordinates[1]))
   print(log_message)
   logging.info(log_message)
   
@@ -2,21 +2,21 @@
 
 import time
 import argparse
-import subprocess
-import astropy.time
+import datetime
+import os
 import sys
-from astropy.coordinates import SkyCoord
 
-def ReadIndi(device, propname):
-  # Call indi_getprop to get the property value
-  command = "indi_getprop \"%s.%s\"" % (device, propname)
-  # Execute the command and get the output.
-  output = subprocess.run(command, shell=True, stdout=subprocess.PIPE).stdout.decode('utf-8')
-  # Parse the output to get the property value.
-  try:
-    output = output.split("=")[1].strip()
-  except:
-    print("Unable to read property '%s' from device '%s'" % (propname, device))
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.dirname(script_dir)
+sys.path.append(parent_dir)
+
+from sky_scripter.lib_indi_xml import IndiXmlClient
+
+def ReadIndi(client, propname):
+  # Read the property over the client's connection to the INDI server.
+  output = client.read(propname)
+  if output is None:
+    print("Unable to read property '%s' from device '%s'" % (propname, client.device))
     sys.exit(1)
   return output
 
@@ -26,17 +26,21 @@ def main():
   parser.add_argument('-t', '--track-status', action='store_true', help='Print tracking status')
   
   args = parser.parse_args()
-  latitude = float(ReadIndi(args.device, "GEOGRAPHIC_COORD.LAT"))
-  longitude = float(ReadIndi(args.device, "GEOGRAPHIC_COORD.LONG"))
-  elevation = float(ReadIndi(args.device, "GEOGRAPHIC_COORD.ELEV"))
-  # site_juliandate = float(ReadIndi(args.device, "JULIAN.JULIANDATE"))
+  client = IndiXmlClient(args.device)
+  latitude = float(ReadIndi(client, "GEOGRAPHIC_COORD.LAT"))
+  longitude = float(ReadIndi(client, "GEOGRAPHIC_COORD.LONG"))
+  elevation = float(ReadIndi(client, "GEOGRAPHIC_COORD.ELEV"))
+  # site_juliandate = float(ReadIndi(client, "JULIAN.JULIANDATE"))
   # current_juliandate = float(astropy.time.Time.now().jd)
   # juliandate_error_seconds = (current_juliandate - site_juliandate) * 86400
   # Get the current time in UTC in format 2024-01-21T18:38:23
-  current_utc = astropy.time.Time.now().utc.datetime.strftime('%Y-%m-%dT%H:%M:%S')
-  site_utc = ReadIndi(args.device, "TIME_UTC.UTC")
+  now = datetime.datetime.now(datetime.timezone.utc)
+  current_utc = now.strftime('%Y-%m-%dT%H:%M:%S')
+  site_utc = ReadIndi(client, "TIME_UTC.UTC")
   # Offset in seconds between site and current UTC time.
-  offset_seconds = (astropy.time.Time.now().unix - astropy.time.Time(site_utc).unix)
+  site_time = datetime.datetime.fromisoformat(site_utc).replace(
+      tzinfo=datetime.timezone.utc)
+  offset_seconds = (now - site_time).total_seconds()
 
   print("Site details for %s:" % args.device)
   print("Latitude:              %9.3f" % latitude)
@@ -51,14 +55,21 @@ def main():
 
   if args.track_status:
     print("Tracking status")
+    # Print once a second on a fixed schedule, so that the time taken to read
+    # the properties does not add up over iterations.
+    next_tick = time.monotonic()
     while True:
-      ra = float(ReadIndi(args.device, "EQUATORIAL_EOD_COORD.RA"))
-      dec = float(ReadIndi(args.device, "EQUATORIAL_EOD_COORD.DEC"))
-      lst = float(ReadIndi(args.device, "TIME_LST.LST"))
+      # Request fresh values over the open connection.
+      client.request("EQUATORIAL_EOD_COORD")
+      client.request("TIME_LST")
+      ra = float(ReadIndi(client, "EQUATORIAL_EOD_COORD.RA"))
+      dec = float(ReadIndi(client, "EQUATORIAL_EOD_COORD.DEC"))
+      lst = float(ReadIndi(client, "TIME_LST.LST"))
       # Convert RA,DEC to HA,DEC.
       ha = lst - ra
       print("RA: %9.6f DEC: %9.3f HA: %9.6f" % (ra, dec, ha))
-      time.sleep(1)
+      next_tick += 1
+      time.sleep(max(0, next_tick - time.monotonic()))
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
@@ -3,47 +3,58 @@
 import os
 import sys
 import argparse
+import glob
+import shutil
 import subprocess
 import time
-import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from sky_scripter.lib_siril import siril_executable
 
 AUTO_YES = False
 
-def run_siril_script(script, input_dir):
+def run_siril_script(script, input_dir, log_file):
   if sys.platform == 'darwin':
     SIRIL_PATH = '/Applications/Siril.app/Contents/MacOS/Siril'
   else:
-    SIRIL_PATH = '/home/joydeepb/Siril-1.2.1-x86_64.AppImage'
+    SIRIL_PATH = siril_executable('/home/joydeepb/Siril-1.2.1-x86_64.AppImage')
   # Define the command to run
   siril_cli_command = [SIRIL_PATH, "-d", input_dir, "-s", "-"]
+  log_file.write(("="*80 + "\n").encode())
+  log_file.write(f"Command: {siril_cli_command}\n".encode())
+  log_file.write(("-"*80 + "\n").encode())
+  log_file.write(f"Script:\n{script}\n".encode())
+  log_file.write(("-"*80 + "\n").encode())
+  # Stream Siril's output straight into the log, instead of buffering all of
+  # it in memory first.
   try:
-    result = subprocess.run(siril_cli_command, 
-                            input=script,
-                            text=True, 
-                            capture_output=True)
-    with open("siril.log", "a") as f:
-      f.write("="*80)
-      f.write(f"Command: {siril_cli_command}\n")
-      f.write("-"*80)
-      f.write(f"Script:\n{script}\n")
-      f.write("-"*80)
-      f.write(f"stdout:\n{result.stdout}\n")
-      f.write("-"*80)
-      f.write(f"stderr:\n{result.stderr}\n")
-      f.write("="*80)
-    if result.returncode != 0:
-      print("Error running Siril.")
-      print(f"stdout:\n{result.stdout}")
-      print(f"stderr:\n{result.stderr}")
+    proc = subprocess.Popen(siril_cli_command,
+                            stdin=subprocess.PIPE,
+                            stdout=log_file,
+                            stderr=log_file)
+    proc.communicate(script.encode())
+    log_file.write(("="*80 + "\n").encode())
+    if proc.returncode != 0:
+      print(f"Error running Siril, see {log_file.name} for its output.")
       # sys.exit(1)
-  except subprocess.CalledProcessError as e:
+  except OSError as e:
     print(f"Error running Siril: {e}")
     # sys.exit(1)
 
+def remove_glob(file_glob):
+  # Remove the matching files and directories directly, without starting a
+  # shell to run rm.
+  for path in glob.iglob(file_glob):
+    if os.path.isdir(path) and not os.path.islink(path):
+      shutil.rmtree(path)
+    else:
+      os.unlink(path)
+
 def delete_with_confirmation(file_glob):
   global AUTO_YES
   if AUTO_YES:
-    os.system(f"rm -rf {file_glob}")
+    remove_glob(file_glob)
     return
   print(f"Deleting all files matching {file_glob}")
   confirmation = ""
@@ -52,43 +63,57 @@ def delete_with_confirmation(file_glob):
     if confirmation not in ["y", "n"]:
       print(f"Please enter 'y' or 'n'.")
   if confirmation == "y":
-    os.system(f"rm -rf {file_glob}")
+    remove_glob(file_glob)
 
 def get_num_light_frames(output_dir):
   # Count the number of light frames in the output directory, matching the
   # pattern "bkg_p_*.fit"
-  files = [name for name in os.listdir(output_dir) if (name.startswith("r_bkg_pp_light_") and name.endswith(".fit"))]
-  files = [os.path.join(output_dir, f) for f in files]
-  files.sort()
+  with os.scandir(output_dir) as entries:
+    files = sorted(entry.path for entry in entries
+                   if entry.name.startswith("r_bkg_pp_light_")
+                   and entry.name.endswith(".fit"))
   num_light_frames = len(files)
   return num_light_frames, files
 
-def create_sub_stack(dirname, files, outputfile):
-  tmpdirname = os.path.join(dirname, "tmp")
-  if not os.path.exists(tmpdirname):
-    os.makedirs(tmpdirname)
-  # remove all files in the temporary directory
-  for f in os.listdir(tmpdirname):
-    os.remove(os.path.join(tmpdirname, f))
-  # print(f"Using temporary directory: {tmpdirname}")
-  # Create symbolic links for n r_bkg_pp_light*.fit files from the output_dir
-  # to tmpdirname. 
-  i = 1
-  for f in files:
-    os.symlink(f, os.path.join(tmpdirname, f"light_{i:05d}.fit"))
-    i += 1
-  # List all the files in the temporary directory
-  # print("Files in temporary directory:")
-  # print(os.listdir(tmpdirname))
-  processing_script = f"""requires 1.2.0
-register light
-stack r_light rej 3 3 -norm=addscale -output_norm -rgb_equal -out={outputfile}
-"""
-  try:
-    run_siril_script(processing_script, tmpdirname)
-  except subprocess.CalledProcessError as e:
-    print(f"Error running Siril: {e}")
+def stack_filename(stack_dir, i):
+  return os.path.join(stack_dir, f'stack_{i+1:05d}.fit')
+
+def pending_windows(files, n, stack_dir):
+  # Returns the start indices of the windows whose stack is missing, or older
+  # than any of its input frames. Frames are shared by overlapping windows, so
+  # each one is only stat'ed once.
+  mtimes = {}
+  def mtime(path):
+    if path not in mtimes:
+      mtimes[path] = os.stat(path).st_mtime
+    return mtimes[path]
+  # Scan the existing stacks once, instead of checking for each of them.
+  with os.scandir(stack_dir) as entries:
+    for entry in entries:
+      mtimes[entry.path] = entry.stat().st_mtime
+  windows = []
+  for i in range(0, len(files) - n):
+    output_file = stack_filename(stack_dir, i)
+    if output_file in mtimes and \
+        mtimes[output_file] >= max(mtime(f) for f in files[i:i+n]):
+      continue
+    windows.append(i)
+  return windows
 
+def partial_stacks_script(num_light_frames, n, stack_dir, windows):
+  # Register the full sequence once, then stack each window of n frames by
+  # selecting it in the registered sequence. A single Siril process does all
+  # the work, instead of re-registering every window in its own process.
+  lines = ["requires 1.2.0",
+           "register r_bkg_pp_light_ -prefix=reg_"]
+  for i in windows:
+    # Image numbers in the sequence start at 1.
+    lines.append(f"unselect reg_r_bkg_pp_light_ 1 {num_light_frames}")
+    lines.append(f"select reg_r_bkg_pp_light_ {i+1} {i+n}")
+    lines.append("stack reg_r_bkg_pp_light_ rej 3 3 -norm=addscale "
+                 "-output_norm -rgb_equal -filter-included "
+                 f"-out={stack_filename(stack_dir, i)}")
+  return "\n".join(lines) + "\n"
 
 def main():
   dirname = "/Users/joydeepbiswas/Astrophotography/2024-03-28-comet_62p/.process/"
@@ -99,15 +124,23 @@ def main():
   # sys.exit(0)
 
   print(f"Number of light frames: {num_light_frames}")
-  
-  for i in range(0, num_light_frames - n):
+  stack_dir = os.path.join(dirname, "stack")
+  os.makedirs(stack_dir, exist_ok=True)
+  windows = pending_windows(files, n, stack_dir)
+  if len(windows) == 0:
+    print("All partial stacks are up to date.")
+    return
+  for i in windows:
     sub_files = files[i:i+n]
-    print(f"Creating stack {i+1:3d} to {i+n:3d} with files:")
+    print(f"Stack {i+1:3d} to {i+n:3d} with files:")
     for f in sub_files:
       # Get the base filename
       print(f"{os.path.basename(f)} ", end="")
     print("\n")
-    create_sub_stack(dirname, sub_files, os.path.join(dirname, f"stack/stack_{i+1:05d}.fit"))
+  with open("siril.log", "ab", buffering=0) as log_file:
+    run_siril_script(
+        partial_stacks_script(num_light_frames, n, stack_dir, windows),
+        dirname, log_file)
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
@@ -3,46 +3,71 @@
 import os
 import sys
 import argparse
+import atexit
+import glob
+import hashlib
+import shutil
 import subprocess
 import time
 
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from sky_scripter.lib_siril import siril_executable
+
 AUTO_YES = False
 
+# Log of all Siril runs, opened once on the first run.
+siril_log = None
+
+def get_siril_log():
+  global siril_log
+  if siril_log is None:
+    siril_log = open("siril.log", "ab", buffering=0)
+    atexit.register(siril_log.close)
+  return siril_log
+
 def run_siril_script(script, input_dir):
   if sys.platform == 'darwin':
     SIRIL_PATH = '/Applications/Siril.app/Contents/MacOS/Siril'
   else:
-    SIRIL_PATH = '/home/joydeepb/Siril-1.2.1-x86_64.AppImage'
+    SIRIL_PATH = siril_executable('/home/joydeepb/Siril-1.2.1-x86_64.AppImage')
   # Define the command to run
   siril_cli_command = [SIRIL_PATH, "-d", input_dir, "-s", "-"]
+  log_file = get_siril_log()
+  log_file.write(("="*80 + "\n").encode())
+  log_file.write(f"Command: {siril_cli_command}\n".encode())
+  log_file.write(("-"*80 + "\n").encode())
+  log_file.write(f"Script:\n{script}\n".encode())
+  log_file.write(("-"*80 + "\n").encode())
+  # Stream Siril's output straight into the log, instead of buffering all
+  # of it in memory first.
   try:
-    result = subprocess.run(siril_cli_command, 
-                            input=script,
-                            text=True, 
-                            capture_output=True)
-    with open("siril.log", "a") as f:
-      f.write("="*80)
-      f.write(f"Command: {siril_cli_command}\n")
-      f.write("-"*80)
-      f.write(f"Script:\n{script}\n")
-      f.write("-"*80)
-      f.write(f"stdout:\n{result.stdout}\n")
-      f.write("-"*80)
-      f.write(f"stderr:\n{result.stderr}\n")
-      f.write("="*80)
-    if result.returncode != 0:
-      print("Error running Siril.")
-      print(f"stdout:\n{result.stdout}")
-      print(f"stderr:\n{result.stderr}")
-      sys.exit(1)
-  except subprocess.CalledProcessError as e:
+    proc = subprocess.Popen(siril_cli_command,
+                            stdin=subprocess.PIPE,
+                            stdout=log_file,
+                            stderr=log_file)
+    proc.communicate(script.encode())
+    log_file.write(("="*80 + "\n").encode())
+  except OSError as e:
     print(f"Error running Siril: {e}")
     sys.exit(1)
+  if proc.returncode != 0:
+    print("Error running Siril, see siril.log for its output.")
+    sys.exit(1)
+
+def remove_glob(file_glob):
+  # Remove the matching files and directories directly, without starting a
+  # shell to run rm.
+  for path in glob.iglob(file_glob):
+    if os.path.isdir(path) and not os.path.islink(path):
+      shutil.rmtree(path)
+    else:
+      os.unlink(path)
 
 def delete_with_confirmation(file_glob):
   global AUTO_YES
   if AUTO_YES:
-    os.system(f"rm -rf {file_glob}")
+    remove_glob(file_glob)
     return
   print(f"Deleting all files matching {file_glob}")
   confirmation = ""
@@ -51,15 +76,39 @@ def delete_with_confirmation(file_glob):
     if confirmation not in ["y", "n"]:
       print(f"Please enter 'y' or 'n'.")
   if confirmation == "y":
-    os.system(f"rm -rf {file_glob}")
+    remove_glob(file_glob)
+
+def preprocessing_fingerprint(input_dir, dark_master, flat_master):
+  # Hash of the name, size and modification time of the input files and
+  # masters, to tell if the preprocessing outputs are up to date. The default
+  # masters are Siril path templates, so only their names are hashed.
+  h = hashlib.blake2b()
+  with os.scandir(input_dir) as entries:
+    inputs = sorted(entry.path for entry in entries if entry.is_file())
+  for path in inputs + [dark_master, flat_master]:
+    h.update(path.encode())
+    if os.path.exists(path):
+      st = os.stat(path)
+      h.update(f"|{st.st_size}|{st.st_mtime_ns}".encode())
+    h.update(b"\n")
+  return h.hexdigest()
 
 def run_preprocessing(input_dir, output_dir, dark_master, flat_master):
+  # Skip preprocessing if it was already done for the same inputs.
+  fingerprint_file = os.path.join(output_dir, ".pipeline_fingerprint")
+  fingerprint = preprocessing_fingerprint(input_dir, dark_master, flat_master)
+  if os.path.exists(os.path.join(output_dir, "r_bkg_pp_light_.seq")) and \
+      os.path.exists(fingerprint_file):
+    with open(fingerprint_file) as f:
+      if f.read() == fingerprint:
+        print("Preprocessing is up to date, skipping it.")
+        return
   print(f"Running preprocessing...")
   t_start = time.time()
   preprocessing_script = f"""requires 1.2.0
-convertraw light -out={output_dir}
+convertraw light -out={output_dir} -fitseq
 cd {output_dir}
-calibrate light -dark={dark_master} -flat={flat_master} -cc=dark -cfa -debayer
+calibrate light -dark={dark_master} -flat={flat_master} -cc=dark -cfa -debayer -fitseq
 seqsubsky pp_light 2
 register bkg_pp_light
 """
@@ -67,6 +116,8 @@ register bkg_pp_light
   run_siril_script(preprocessing_script, input_dir)
   t_end = time.time()
   print(f"Preprocessing complete. Time taken: {t_end - t_start:.3f} seconds.")
+  with open(fingerprint_file, "w") as f:
+    f.write(fingerprint)
   
   # Delete intermediate files.
   delete_with_confirmation(f"{output_dir}/light_*.fit*")
@@ -74,78 +125,71 @@ register bkg_pp_light
   delete_with_confirmation(f"{output_dir}/bkg_pp_light_*.fit*")
 
 def get_num_light_frames(output_dir):
-  # Count the number of light frames in the output directory, matching the pattern "bkg_p_*.fit"
-  num_light_frames = len([name for name in os.listdir(output_dir) if (name.startswith("r_bkg_pp_light_") and name.endswith(".fit"))])
-  return num_light_frames
+  # Read the number of images of the registered sequence from its .seq file,
+  # since the frames are stored in a single FITS cube. Example:
+  # S 'r_bkg_pp_light_' 1 120 120 5 -1 4
+  with open(os.path.join(output_dir, "r_bkg_pp_light_.seq")) as f:
+    for line in f:
+      if line.startswith("S "):
+        return int(line.split()[3])
+  return 0
+
+def existing_dir(path):
+  # argparse type for a directory that must exist, as an absolute path.
+  path = os.path.abspath(path)
+  if not os.path.isdir(path):
+    raise argparse.ArgumentTypeError(f"directory {path} does not exist")
+  return path
+
+def existing_file(path):
+  # argparse type for a file that must exist, as an absolute path.
+  path = os.path.abspath(path)
+  if not os.path.exists(path):
+    raise argparse.ArgumentTypeError(f"{path} does not exist")
+  return path
 
 def check_args(args):
   global AUTO_YES
-  # Check if the input directory exists
-  if not os.path.exists(args.input):
-    print(f"Input directory {args.input} does not exist.")
-    sys.exit(1)
-
   # Check if the output directory exists, if not create it.
   if not os.path.exists(args.output):
     print(f"Output directory {args.output} does not exist. Creating it.")
     os.makedirs(args.output)
 
-  # If the dark master is provided, check if it exists.
-  if args.dark and not os.path.exists(args.dark):
-    print(f"Dark master {args.dark} does not exist.")
-    sys.exit(1)
-
-  # If the flat master is provided, check if it exists.
-  if args.flat and not os.path.exists(args.flat):
-    print(f"Flat master {args.flat} does not exist.")
-    sys.exit(1)
-
   if args.yes:
     AUTO_YES = True
     print("Automatic yes to prompts enabled.")
-  # Convert all arguments to absolute paths.
-  args.input = os.path.abspath(args.input)
-  args.output = os.path.abspath(args.output)
-  if args.dark:
-    args.dark = os.path.abspath(args.dark)
-  else:
+  # Use the default masters if none are provided.
+  if not args.dark:
     args.dark = "/Users/joydeepbiswas/Astrophotography/masters/master_bias_ISO$ISOSPEED:%d$"
-  if args.flat:
-    args.flat = os.path.abspath(args.flat)
-  else:
+  if not args.flat:
     args.flat = "/Users/joydeepbiswas/Astrophotography/masters/master_flat_ISO$ISOSPEED:%d$"
 
-def create_sub_stack(output_dir, sub_stack_size):
-  sub_stack_dir = f"{output_dir}/sub_stack_{sub_stack_size}"
-  if not os.path.exists(sub_stack_dir):
-    os.makedirs(sub_stack_dir)
-  delete_with_confirmation(f"{sub_stack_dir}/*")
+def create_sub_stacks(output_dir, num_light_frames, sub_stack_sizes):
   t_start = time.time()
-  # Create symbolic links for sub_stack_size number of r_bkg_pp_light*.fit
-  # files from the output_dir to tmpdirname. 
-  lights = [name for name in os.listdir(output_dir) if (name.startswith("r_bkg_pp_light_") and name.endswith(".fit"))]
-  lights.sort()
-  for i in range(sub_stack_size):
-    os.symlink(f"{output_dir}/{lights[i]}", f"{sub_stack_dir}/light_{i+1:05d}.fit")
-  sub_stack_fits_file = f"{output_dir}/sub_stack_{sub_stack_size:05d}.fit"
-  sub_stack_jpg_file = f"{output_dir}/sub_stack_{sub_stack_size:05d}"
-  print(f"Creating sub-stack of size {sub_stack_size}")
-  print(f"Output FITS file: {sub_stack_fits_file}")
-  print(f"Output JPG file: {sub_stack_jpg_file}.jpg")
-  processing_script = f"""requires 1.2.0
-register light
-stack r_light rej 3 3 -norm=addscale -output_norm -rgb_equal -out={sub_stack_fits_file}
-load {sub_stack_fits_file}
-fixbanding 1 1 -vertical
-fixbanding 1 1 
-autostretch
-savejpg {sub_stack_jpg_file}
-"""
-  run_siril_script(processing_script, sub_stack_dir)
+  # Stack the first sub_stack_size frames of the registered sequence for each
+  # size, by selecting them. All sizes are stacked by a single Siril process,
+  # without re-registering each subset.
+  lines = ["requires 1.2.0"]
+  for sub_stack_size in sub_stack_sizes:
+    sub_stack_fits_file = f"{output_dir}/sub_stack_{sub_stack_size:05d}.fit"
+    sub_stack_jpg_file = f"{output_dir}/sub_stack_{sub_stack_size:05d}"
+    print(f"Creating sub-stack of size {sub_stack_size}")
+    print(f"Output FITS file: {sub_stack_fits_file}")
+    print(f"Output JPG file: {sub_stack_jpg_file}.jpg")
+    lines += [f"unselect r_bkg_pp_light 1 {num_light_frames}",
+              f"select r_bkg_pp_light 1 {sub_stack_size}",
+              "stack r_bkg_pp_light rej 3 3 -norm=addscale -output_norm "
+              f"-rgb_equal -filter-included -out={sub_stack_fits_file}",
+              f"load {sub_stack_fits_file}",
+              "fixbanding 1 1 -vertical",
+              "fixbanding 1 1 ",
+              "autostretch",
+              f"savejpg {sub_stack_jpg_file}"]
+  # Leave all frames of the sequence selected.
+  lines.append(f"select r_bkg_pp_light 1 {num_light_frames}")
+  run_siril_script("\n".join(lines) + "\n", output_dir)
   t_end = time.time()
   print(f"Sub-stack creation complete. Time taken: {t_end - t_start:.3f} seconds.")
-  # Delete intermediate files.
-  delete_with_confirmation(f"{sub_stack_dir}/r_light*.fit*")
 
 def creat_main_stack(output_dir):
   print(f"Creating main stack...")
@@ -172,10 +216,14 @@ def main():
   parser = argparse.ArgumentParser(description = 
       "Generate a progressive stack from a directory of raw captures.")
 
-  parser.add_argument("-i", "--input", help="Input directory.", required=True)
-  parser.add_argument("-o", "--output", help="Output directory.", required=True)
-  parser.add_argument("--dark", help="Dark master.", required=False)
-  parser.add_argument("--flat", help="Flat master.", required=False)
+  parser.add_argument("-i", "--input", help="Input directory.", required=True,
+                      type=existing_dir)
+  parser.add_argument("-o", "--output", help="Output directory.", required=True,
+                      type=os.path.abspath)
+  parser.add_argument("--dark", help="Dark master.", required=False,
+                      type=existing_file)
+  parser.add_argument("--flat", help="Flat master.", required=False,
+                      type=existing_file)
   parser.add_argument("-y", "--yes", help="Automatic yes to prompts.", 
                       action="store_true")
   args = parser.parse_args()
@@ -188,10 +236,12 @@ def main():
   creat_main_stack(args.output)
 
   return
+  sub_stack_sizes = []
   sub_stack_size = num_light_frames
   while sub_stack_size > 1:
-    create_sub_stack(args.output, sub_stack_size)
+    sub_stack_sizes.append(sub_stack_size)
     sub_stack_size = sub_stack_size // 2
+  create_sub_stacks(args.output, num_light_frames, sub_stack_sizes)
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
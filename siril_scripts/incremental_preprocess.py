@@ -4,13 +4,14 @@ import argparse
 import sys
 import os
 import time
+import shutil
 import subprocess
 from dateutil.parser import parse
 import logging
 from datetime import datetime, timedelta, timezone
 from dateutil import tz
 import signal
-import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
@@ -26,6 +27,9 @@ from sky_scripter.util import init_logging, print_and_log, parse_coordinates
 from sky_scripter.lib_phd2 import Phd2Client
 from sky_scripter.lib_rachio import RachioClient, get_rachio_key
 from sky_scripter.algorithms import auto_focus
+from sky_scripter.lib_siril import siril_executable
+
+SIRIL_PATH = siril_executable(SIRIL_PATH)
 
 # Global variable to indicate if the capture should be terminated - set by
 # signal handler, and checked by the main loop.
@@ -39,10 +43,13 @@ def signal_handler(signum, frame):
 def get_args():
   parser = argparse.ArgumentParser(description='Incremental preprocessing script')
   # Target to image.
-  parser.add_argument('-d', '--directory', type=str, required=True,
-      help='Directory to process images from')
+  parser.add_argument('-d', '--directory', type=str, nargs='+', required=True,
+      help='Directories to process images from, e.g. one per filter')
   parser.add_argument('-v', '--verbose', action='store_true',
       help='Print verbose messages')
+  parser.add_argument('-s', '--scratch', type=str,
+      help='Directory for intermediate files (default: /dev/shm if it has '
+           'room, else ../.process next to the input directory)')
   return parser.parse_args()
 
 def signal_handler(signum, frame):
@@ -55,97 +62,157 @@ def signal_handler(signum, frame):
     print_and_log('Hit Ctrl-C again to terminate immediately')
   terminate_count += 1
 
-def convert_lights(directory):
-  siril_commands = f"""requires 1.2.0
-convert light -out=../.process
-close
-"""
+def run_siril_script(siril_commands, directory, log_dir=None):
   # Define the command to run
   siril_cli_command = [SIRIL_PATH, "-d", directory, "-s", "-"]
-  # Run the command and capture output
-  try:
+  # Stream Siril's output into siril.log, by default in the working directory,
+  # instead of buffering all of it in memory.
+  log_path = os.path.join(log_dir or directory, "siril.log")
+  with open(log_path, "ab") as log_file:
     result = subprocess.run(siril_cli_command,
-                            input=siril_commands,
-                            text=True,
-                            capture_output=True,
-                            check=True)
-    if result.returncode != 0:
-      print("Error running Siril.")
-      exit(1)
-  except subprocess.CalledProcessError as e:
-    print("Error running Siril.")
+                            input=siril_commands.encode(),
+                            stdout=log_file,
+                            stderr=log_file)
+  if result.returncode != 0:
+    print(f"Error running Siril, see {log_path}.")
     exit(1)
 
-def calibrate_single_light(light_file, directory):
-  # Check if pp_light file exists
-  pp_file = light_file.replace('light_', 'pp_light_')
-  bkg_file = light_file.replace('light_', 'bkg_pp_light_')
-  if os.path.exists(os.path.join(directory, bkg_file)):
-    return
-  print(f'Calibrating {light_file}')
-  siril_commands = f"""requires 1.2.0
-calibrate_single {light_file} -dark=/Users/joydeepbiswas/Astrophotography/masters/dark/master_dark_MODE$READMODE:%1d$_GAIN$GAIN:%2d$_OFFSET$OFFSET:%2d$_EXPTIME$EXPTIME:%3d$ -flat=/Users/joydeepbiswas/Astrophotography/masters/flat/master_flat_$FILTER:%s$ -cc=dark
-load {pp_file}
-subsky 2 -tolerance=100
-save {bkg_file}
-close
-"""
-  # Define the command to run
-  siril_cli_command = [SIRIL_PATH, "-d", directory, "-s", "-"]
-  # Run the command and capture output
+def get_scratch_root(input_directories, scratch_dir=None):
+  # Siril writes and re-reads the converted, calibrated and registered frames
+  # between each of its passes. Keep them in RAM if there is room for all the
+  # directories, since the calibrated frames are 32-bit and several copies of
+  # each light are kept. Returns None to keep them next to the inputs.
+  if scratch_dir is not None:
+    return os.path.abspath(scratch_dir)
+  if os.access('/dev/shm', os.W_OK):
+    input_size = 0
+    for input_directory in input_directories:
+      with os.scandir(input_directory) as entries:
+        input_size += sum(entry.stat().st_size for entry in entries
+                          if entry.is_file())
+    if shutil.disk_usage('/dev/shm').free > 8 * input_size:
+      return os.path.join('/dev/shm', 'siril_process')
+  return None
+
+def get_process_dir(input_directory, scratch_root, per_directory):
+  # Directories processed together each get their own intermediate files.
+  if scratch_root is None:
+    process_dir = os.path.abspath(os.path.join(input_directory, '../.process'))
+  else:
+    process_dir = scratch_root
+  if per_directory:
+    process_dir = os.path.join(process_dir, os.path.basename(input_directory))
+  return process_dir
+
+# Raw lights already converted and calibrated, with the batch they were
+# processed in. Kept next to the intermediate files, so that they are
+# reprocessed whenever the intermediate files are lost.
+PROCESSED_LIGHTS_FILE = 'processed_lights.txt'
+
+def list_lights(input_directory):
+  # Siril converts the lights in file name order.
+  with os.scandir(input_directory) as entries:
+    return sorted(entry.name for entry in entries
+                  if entry.is_file() and not entry.name.startswith('.'))
+
+def read_processed_lights(process_dir):
+  processed = {}
   try:
-    result = subprocess.run(siril_cli_command,
-                            input=siril_commands,
-                            text=True,
-                            capture_output=True,
-                            check=True)
-    if result.returncode != 0:
-      print("Error running Siril.")
-      exit(1)
-  except subprocess.CalledProcessError as e:
-    print("Error running Siril.")
-    exit(1)
+    with open(os.path.join(process_dir, PROCESSED_LIGHTS_FILE)) as f:
+      for line in f:
+        batch, _, light = line.rstrip('\n').partition(' ')
+        processed[light] = batch
+  except FileNotFoundError:
+    pass
+  return processed
 
-def calibrate_lights(directory):
-  # Find all light_*.fit files in the directory
-  light_files = [f for f in os.listdir(directory) if f.startswith('light_') and f.endswith('.fit')]
+def write_processed_lights(process_dir, batch, lights):
+  with open(os.path.join(process_dir, PROCESSED_LIGHTS_FILE), 'a') as f:
+    for light in lights:
+      f.write(f'{batch} {light}\n')
 
-  with multiprocessing.Pool(15) as pool:
-    pool.starmap(calibrate_single_light, [(f, directory) for f in light_files])
+def stage_new_lights(input_directory, process_dir, batch, lights):
+  # Link only the new lights into their own directory, so that Siril converts
+  # and calibrates just them.
+  stage_dir = os.path.join(process_dir, f'new_{batch}')
+  shutil.rmtree(stage_dir, ignore_errors=True)
+  os.makedirs(stage_dir)
+  for light in lights:
+    os.symlink(os.path.join(input_directory, light),
+               os.path.join(stage_dir, light))
+  return stage_dir
 
-def register_and_stack(directory):
-  print(f'Registering and stacking')
-  siril_commands = f"""requires 1.2.0
-register bkg_pp_light
-stack r_bkg_pp_light rej 3 3  -norm=addscale -output_norm -weight_from_wfwhm -out=../../master_light_$FILTER:%s$
-close
+def convert_lights(stage_dir, process_dir, batch):
+  return f"""cd {stage_dir}
+convert light_{batch} -out={process_dir} -fitseq
+cd {process_dir}
+"""
+
+def calibrate_lights(batch):
+  # Calibrate the new lights as one sequence: Siril runs sequence operations
+  # on all cores.
+  return f"""calibrate light_{batch} -dark=/Users/joydeepbiswas/Astrophotography/masters/dark/master_dark_MODE$READMODE:%1d$_GAIN$GAIN:%2d$_OFFSET$OFFSET:%2d$_EXPTIME$EXPTIME:%3d$ -flat=/Users/joydeepbiswas/Astrophotography/masters/flat/master_flat_$FILTER:%s$ -cc=dark -fitseq
+seqsubsky pp_light_{batch} 2 -tolerance=100
 """
-  # Define the command to run
-  siril_cli_command = [SIRIL_PATH, "-d", directory, "-s", "-"]
-  # Run the command and capture output
-  try:
-    result = subprocess.run(siril_cli_command,
-                            input=siril_commands,
-                            text=True,
-                            capture_output=True,
-                            check=True)
-    if result.returncode != 0:
-      print("Error running Siril.")
-      exit(1)
-  except subprocess.CalledProcessError as e:
-    print("Error running Siril.")
-    exit(1)
+
+def register_and_stack(batches, master_dir):
+  # Register and stack the calibrated lights of all the batches together.
+  if len(batches) > 1:
+    bkg_sequences = ' '.join(f'bkg_pp_light_{batch}' for batch in batches)
+    siril_commands = f"merge {bkg_sequences} bkg_pp_light\n"
+    sequence = 'bkg_pp_light'
+  else:
+    siril_commands = ''
+    sequence = f'bkg_pp_light_{batches[0]}'
+  return siril_commands + f"""register {sequence}
+stack r_{sequence} rej 3 3  -norm=addscale -output_norm -weight_from_wfwhm -out={master_dir}/master_light_$FILTER:%s$
+"""
+
+def process_directory(input_directory, process_dir):
+  print(f'Processing directory {input_directory}')
+  os.makedirs(process_dir, exist_ok=True)
+  print(f'Intermediate files in {process_dir}')
+  processed = read_processed_lights(process_dir)
+  batches = sorted(set(processed.values()))
+  new_lights = [light for light in list_lights(input_directory)
+                if light not in processed]
+  # Every light is already in the master stack from an earlier run.
+  if not new_lights:
+    print(f'No new lights in {input_directory}')
+    return
+  # The master is saved two levels above the input directory, wherever the
+  # intermediate files are.
+  master_dir = os.path.abspath(os.path.join(input_directory, '../..'))
+  # Run all the steps in a single Siril process, instead of starting Siril
+  # once per step.
+  batch = f'b{len(batches) + 1:04d}'
+  batches.append(batch)
+  print(f'Converting and calibrating {len(new_lights)} new lights')
+  stage_dir = stage_new_lights(input_directory, process_dir, batch,
+                               new_lights)
+  siril_commands = "requires 1.2.0\n" + \
+      convert_lights(stage_dir, process_dir, batch) + \
+      calibrate_lights(batch)
+  print(f'Registering and stacking {len(processed) + len(new_lights)} lights')
+  siril_commands += register_and_stack(batches, master_dir) + "close\n"
+  run_siril_script(siril_commands, input_directory, process_dir)
+  # Only record the new lights once Siril has processed them successfully.
+  write_processed_lights(process_dir, batch, new_lights)
+  shutil.rmtree(stage_dir, ignore_errors=True)
 
 def main():
   args = get_args()
-  input_directory = os.path.abspath(args.directory)
-  print(f'Processing directory {input_directory}')
-  print(f'Converting lights')
-  convert_lights(input_directory)
-  process_dir = os.path.join(input_directory, '../.process')
-  print(f'Calibrating lights')
-  calibrate_lights(process_dir)
-  register_and_stack(process_dir)
+  input_directories = [os.path.abspath(d) for d in args.directory]
+  scratch_root = get_scratch_root(input_directories, args.scratch)
+  per_directory = len(input_directories) > 1
+  process_dirs = [get_process_dir(d, scratch_root, per_directory)
+                  for d in input_directories]
+  # The directories, e.g. one per filter, are independent: process them
+  # concurrently. Siril already uses several threads per run, so only run a
+  # few of them at a time.
+  max_workers = max(1, min(len(input_directories), os.cpu_count() // 4))
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    list(executor.map(process_directory, input_directories, process_dirs))
 
 if __name__ == '__main__':
-  main()
\ No newline at end of file
+  main()
@@ -3,6 +3,7 @@
 import os
 import sys
 import subprocess
+import pathlib
 
 if sys.platform == 'darwin':
   SIRIL_PATH = '/Applications/Siril.app/Contents/MacOS/Siril'
@@ -16,11 +17,13 @@ def main():
     sys.exit(1)
   script_name = sys.argv[1]
   directory = sys.argv[2]
-  script_content = open(script_name).read()
+  # Pass the script to Siril as bytes, without decoding and re-encoding it.
+  script_content = pathlib.Path(script_name).read_bytes()
   # Get full absolute path to the specified directory.
   directory = os.path.abspath(directory)
   # Run the script in the specified directory, piping stdout and stderr to the console.
-  subprocess.run([SIRIL_PATH, '-d', directory, '-s', "-"], input=script_content, text=True)
+  result = subprocess.run([SIRIL_PATH, '-d', directory, '-s', "-"], input=script_content)
+  sys.exit(result.returncode)
 
 if __name__ == '__main__':
   main()
\ No newline at end of file
@@ -1,7 +1,5 @@
 import math
-import astropy.time
 import time
-import astropy.units as units
 import logging
 import os
 import sys
@@ -14,59 +12,87 @@ parent_dir = os.path.dirname(script_dir)
 sys.path.append(parent_dir)
 
 from sky_scripter.lib_indi import IndiMount, IndiFocuser, IndiCamera
-from sky_scripter.util import exec_or_fail, init_logging, parse_coordinates, run_plate_solve_astap, print_and_log, run_star_detect_siril
+from sky_scripter.util import exec_or_fail, init_logging, parse_coordinates, run_plate_solve_astap, print_and_log, run_star_detect_siril, prefetch_astap_database, format_sexagesimal
 from sky_scripter.lib_gphoto import GphotoClient
 
 def align_to_object(mount: IndiMount,
                     camera: IndiCamera,
                     ra_target, dec_target,
                     threshold,
-                    max_iterations=10):
+                    max_iterations=10,
+                    fov=None):
   image_dir = os.path.join(os.getcwd(), '.align')
   os.makedirs(image_dir, exist_ok=True)
   def compute_error(ra_target, dec_target, ra, dec):
-    # Compute error in arcseconds. RA is in hours, DEC is in degrees.
-    ra_error = abs(ra_target - ra) / 24 * 360 * 3600
-    dec_error = abs(dec_target - dec) * 3600
-    return math.sqrt(ra_error**2 + dec_error**2)
+    # Compute the angular separation in arcseconds, using the haversine
+    # formula. RA is in hours, DEC is in degrees.
+    ra1, ra2 = math.radians(ra_target * 15), math.radians(ra * 15)
+    dec1, dec2 = math.radians(dec_target), math.radians(dec)
+    a = math.sin((dec2 - dec1) / 2)**2 + \
+        math.cos(dec1) * math.cos(dec2) * math.sin((ra2 - ra1) / 2)**2
+    return math.degrees(2 * math.asin(min(1, math.sqrt(a)))) * 3600
 
   def image_filename():
     return os.path.join(
         image_dir,
         'align-' + time.strftime("%Y-%m-%d-%H-%M-%S") + '.fits')
-  # Repeat capture, sync, goto until within threshold, or max iterations reached.
+  prefetch_astap_database()
+  # Repeat capture, sync, goto until within threshold, the error stops
+  # improving, or max iterations reached.
   iteration = 0
+  errors = []
   while iteration < max_iterations:
     iteration += 1
     print(f"Iteration {iteration}", end=' | ', flush=True)
-    t_start = astropy.time.Time.now()
+    t_start = time.time()
     print('GoTo', end=' | ', flush=True)
     mount.goto(ra_target, dec_target)
     print("Capture", end=' | ', flush=True)
     filename = image_filename()
     camera.capture_image(filename)
     print('Plate solve', end=' | ', flush=True)
-    ra, dec = run_plate_solve_astap(filename)
+    # The mount was just slewed to the target, so search around it: widely on
+    # the first iteration, and narrowly once the mount has been synced.
+    radius = 5 if iteration == 1 else 1
+    ra, dec = run_plate_solve_astap(filename,
+                                    ra_hint=ra_target,
+                                    dec_hint=dec_target,
+                                    radius=radius,
+                                    fov=fov,
+                                    downsample=2)
+    if ra is None or dec is None:
+      # Fall back to a blind solve if the hinted search failed.
+      ra, dec = run_plate_solve_astap(filename)
+    if ra is None or dec is None:
+      # Never sync the mount on a failed solve: capture and solve again.
+      print_and_log(f"Plate solve failed for {filename}, retrying",
+                    level=logging.WARNING)
+      continue
     print('Sync', end=' | ', flush=True)
     mount.sync(ra, dec)
-    t_end = astropy.time.Time.now()
+    t_end = time.time()
     error = compute_error(ra_target, dec_target, ra, dec)
     # Print RA in HH:MM:SS and DEC in DD:MM:SS, and error in arcseconds.
-    ra_hms = astropy.coordinates.Angle(ra, unit=units.hour). \
-        to_string(unit=units.hour, sep=':')
-    dec_dms = astropy.coordinates.Angle(dec, unit=units.deg). \
-        to_string(unit=units.deg, sep=':')
+    ra_hms = format_sexagesimal(ra)
+    dec_dms = format_sexagesimal(dec)
     print(f"RA: {ra_hms}, DEC: {dec_dms}, Error: {error:4.1f}" +
-          f" | Iteration time: {(t_end - t_start).sec:4.1f}")
+          f" | Iteration time: {(t_end - t_start):4.1f}")
     logging.info(f"Iteration {iteration} " +
                  f"RA: {ra_hms:17s}, DEC: {dec_dms:17s}, " +
                  f"Error: {error:4.1f}, " +
-                 f"Iteration time: {(t_end - t_start).sec:4.1f}, " +
+                 f"Iteration time: {(t_end - t_start):4.1f}, " +
                  f"Filename: {filename}")
+    errors.append(error)
     if error < threshold:
       complete = True
       print_and_log(f"Alignment complete in {iteration} iterations")
       return True
+    # Further iterations will not help if the error has stalled, e.g. due to
+    # backlash or seeing.
+    if len(errors) >= 3 and errors[-1] > 0.9 * errors[-2]:
+      print_and_log(f"Alignment stalled after {iteration} iterations, " +
+                    f"error: {error:4.1f}", level=logging.WARNING)
+      return False
 
   if iteration == max_iterations:
     print("ERROR: Max iterations reached")
@@ -0,0 +1,281 @@
+import os
+import re
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+
+from sky_scripter.lib_siril import siril_executable
+
+# Optional: with rawpy and photutils installed, stars are detected in-process
+# instead of starting Siril for every capture.
+try:
+  import rawpy
+  from photutils.detection import DAOStarFinder
+except ImportError:
+  rawpy = None
+
+# Optional: with numba installed, the FWHM row scan is compiled.
+try:
+  from numba import njit
+except ImportError:
+  njit = None
+
+# Minimum number of stars detected in a downsampled image for its FWHM to be
+# used, otherwise the full resolution image is analyzed.
+MIN_STARS = 10
+
+# Siril findstar summary, e.g.:
+# Found 343 Gaussian profile stars in image, channel #0 (FWHM 5.428217)
+FINDSTAR_REGEX = re.compile(
+    r"Found ([0-9]+) Gaussian profile stars in image, channel #[0-9] \(FWHM ([0-9]+\.[0-9]+)\)")
+
+# Star finder for images normalized to unit noise, reused across captures.
+star_finder = None
+
+# Temporary buffers for the zoom image analysis, by name, shape and type.
+scratch_buffers = {}
+
+def detect_stars_siril(image_file, downsample=2):
+  # If MacOS, use the Siril.app version
+  if sys.platform == 'darwin':
+    SIRIL_PATH = '/Applications/Siril.app/Contents/MacOS/siril-cli'
+  else:
+    SIRIL_PATH = siril_executable('/home/joydeepb/Siril-1.2.1-x86_64.AppImage')
+
+  # Load the RAW file directly: calibrating it first would write and re-read
+  # a full-size FITS file on every capture. Star detection on a downsampled
+  # image is much faster, and accurate enough to compare focus positions.
+  resample_command = f"resample {1 / downsample}" if downsample > 1 else ""
+  siril_commands = f"""requires 1.2.0
+load {os.path.basename(image_file)}
+{resample_command}
+findstar
+close
+"""
+  # Define the command to run
+  image_dir = os.path.dirname(os.path.abspath(image_file))
+  siril_cli_command = [SIRIL_PATH, "-d", image_dir, "-s", "-"]
+
+  # Run the command and capture output
+  try:
+    result = subprocess.run(siril_cli_command,
+                            input=siril_commands,
+                            text=True,
+                            capture_output=True,
+                            check=True)
+    # Extract the number of stars detected, and the FWHM.
+    match = FINDSTAR_REGEX.search(result.stdout)
+    num_stars, fwhm = match.groups() if match else (0, 0)
+    if int(num_stars) < MIN_STARS and downsample > 1:
+      # Too few stars in the downsampled image, retry at full resolution.
+      return detect_stars_siril(image_file, downsample=1)
+    if not match:
+      print("No match found")
+      return None, None
+    # Scale the FWHM back to full resolution pixels.
+    return int(num_stars), float(fwhm) * downsample
+  except subprocess.CalledProcessError as e:
+    print(f"Error running Siril: {e.stderr}")
+    return None, None
+
+def detect_stars_rawpy(image_file, max_stars=100, box_radius=7):
+  global star_finder
+  # Use a single CFA channel, at half the sensor resolution.
+  with rawpy.imread(image_file) as raw:
+    image = raw.raw_image_visible[::2, ::2].astype(np.float32)
+  image -= np.median(image)
+  image /= np.std(image)
+  if star_finder is None:
+    star_finder = DAOStarFinder(fwhm=3.0, threshold=5.0, exclude_border=True)
+  sources = star_finder(image)
+  if sources is None or len(sources) == 0:
+    return None, None
+  # Estimate the FWHM of the brightest stars from the second moments of a
+  # small box around each of them.
+  sources.sort('flux', reverse=True)
+  y, x = np.mgrid[-box_radius:box_radius + 1, -box_radius:box_radius + 1]
+  fwhms = []
+  for source in sources[:max_stars]:
+    xc = int(round(source['xcentroid']))
+    yc = int(round(source['ycentroid']))
+    box = image[yc - box_radius:yc + box_radius + 1,
+                xc - box_radius:xc + box_radius + 1]
+    if box.shape != x.shape:
+      continue
+    box = np.clip(box, 0, None)
+    total = box.sum()
+    if total <= 0:
+      continue
+    dx = (box * x).sum() / total
+    dy = (box * y).sum() / total
+    variance = (box * ((x - dx)**2 + (y - dy)**2)).sum() / (2 * total)
+    fwhms.append(2.3548 * np.sqrt(variance))
+  if len(fwhms) == 0:
+    return len(sources), None
+  # Scale the FWHM back to full resolution pixels.
+  return len(sources), float(np.median(fwhms)) * 2
+
+def detect_stars(image_file):
+  # Returns the number of stars and their FWHM in full resolution pixels.
+  if rawpy is not None:
+    return detect_stars_rawpy(image_file)
+  return detect_stars_siril(image_file)
+
+def scratch_buffer(name, shape, dtype):
+  # Reuse per-frame temporary buffers across zoom updates, instead of
+  # allocating new ones every frame.
+  key = (name, shape, dtype)
+  if key not in scratch_buffers:
+    scratch_buffers[key] = np.empty(shape, dtype)
+  return scratch_buffers[key]
+
+def find_star(image):
+  # Convert to grayscale and normalize
+  gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+  gray = cv2.normalize(gray, scratch_buffer('normalize', gray.shape, gray.dtype),
+                       0, 255, cv2.NORM_MINMAX)
+  # Find the brightest point
+  (minVal, maxVal, minLoc, maxLoc) = cv2.minMaxLoc(gray)
+  # Find the centroid of the pixels that have the maximum value, in a small
+  # window around the brightest point.
+  x, y = maxLoc
+  x0, y0 = max(0, x - 8), max(0, y - 8)
+  roi = gray[y0:y + 9, x0:x + 9]
+  _, mask = cv2.threshold(roi, maxVal - 1, 255, cv2.THRESH_BINARY)
+  M = cv2.moments(mask, binaryImage=True)
+  return (int(x0 + M['m10'] / M['m00']), int(y0 + M['m01'] / M['m00'])), maxVal
+
+def fwhm_crossings(row, x, half_max):
+  # Walk outward from the star to the first pixel below half max on either
+  # side. Returns -1, -1 if either side has no such pixel.
+  left = x - 1
+  while left >= 0 and row[left] >= half_max:
+    left -= 1
+  right = x
+  while right < row.shape[0] and row[right] >= half_max:
+    right += 1
+  if left < 0 or right >= row.shape[0]:
+    return -1, -1
+  return left, right
+
+if njit is not None:
+  fwhm_crossings = njit(cache=True)(fwhm_crossings)
+  # Compile now, so that the first zoom update does not wait for it.
+  fwhm_crossings(np.zeros(2, np.uint8), 0, 0.0)
+
+def compute_fwhm(image, star_location, max_val):
+  x, y = star_location
+  row = image[y, :]
+  max_intensity = max_val
+  # Find the half max value
+  half_max = max_intensity / 2
+  if row.ndim > 1:
+    # A pixel is below half max if any of its channels is.
+    row = row.min(axis=1)
+  left_idx, right_idx = fwhm_crossings(row, x, float(half_max))
+  # Check if crossings are found
+  if left_idx >= 0:
+    fwhm = right_idx - left_idx
+    return fwhm
+  else:
+    # Handle case where FWHM cannot be computed
+    return None
+
+def init_interactive_opencv():
+  # The interactive focus tools only process small crops, on which starting
+  # OpenCV worker threads or an OpenCL context costs more than the work.
+  cv2.setNumThreads(1)
+  cv2.ocl.setUseOpenCL(False)
+
+def show_image(window_name, image):
+  cv2.imshow(window_name, image)
+  # Resize the window to fit the screen.
+  cv2.resizeWindow(window_name, 1500, 1000)
+  return image
+
+def display_image(window_name, image_path):
+  return show_image(window_name, cv2.imread(image_path))
+
+def display_image_bytes(window_name, image_bytes):
+  # Decode an image file that is already in memory, e.g. captured with
+  # gphoto2 --stdout, instead of writing it to disk and reading it back.
+  image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+  return show_image(window_name, image)
+
+def render_label(text):
+  # Render a text label on a black box, to be pasted onto the zoomed image.
+  label = np.zeros((25, 300, 3), np.uint8)
+  cv2.putText(label, text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2, cv2.LINE_AA)
+  return label
+
+# The overlay labels do not change between frames, so only the values are
+# drawn per frame, to the right of the longest label.
+LAPLACIAN_LABEL = render_label('Laplacian:')
+FWHM_LABEL = render_label('FWHM:')
+LABEL_WIDTH = 10 + cv2.getTextSize('Laplacian:', cv2.FONT_HERSHEY_SIMPLEX, 0.75, 2)[0][0]
+
+def zoom_image(image, click_point, zoom_factor=8, window_size=(400, 400)):
+  # Calculate the zoomed area dimensions
+  x, y = click_point
+  width, height = image.shape[1], image.shape[0]
+  zoom_width, zoom_height = window_size[0] // zoom_factor, window_size[1] // zoom_factor
+
+  # Define the ROI
+  x1 = max(x - zoom_width // 2, 0)
+  y1 = max(y - zoom_height // 2, 0)
+  x2 = min(x1 + zoom_width, width)
+  y2 = min(y1 + zoom_height, height)
+
+  # Crop the image, and analyze the crop at its original resolution:
+  # upscaling it first would only multiply the work.
+  zoomed_img = image[y1:y2, x1:x2]
+  # The focus metrics only need luminance: convert the crop to grayscale once,
+  # and keep the color crop for display.
+  if zoomed_img.ndim == 2:
+    gray = zoomed_img
+    zoomed_img = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+  else:
+    gray = cv2.cvtColor(zoomed_img, cv2.COLOR_BGR2GRAY)
+  # Compute the variance of the laplacian to check if the image is blurry.
+  # 16-bit output is enough for 8-bit images, and meanStdDev computes the
+  # variance in a single pass.
+  laplacian_img = cv2.Laplacian(gray, cv2.CV_16S,
+                                scratch_buffer('laplacian', gray.shape, np.int16),
+                                ksize=3)
+  _, std = cv2.meanStdDev(laplacian_img)
+  laplacian = float(std[0, 0]) ** 2
+
+  # Star detection
+  star_location, max_val = find_star(gray)
+
+  # Compute FWHM
+  fwhm = compute_fwhm(gray, star_location, max_val)
+
+  # Resize the image for display, and scale the star location to match.
+  scale_x = window_size[0] / zoomed_img.shape[1]
+  scale_y = window_size[1] / zoomed_img.shape[0]
+  zoomed_img = cv2.resize(zoomed_img, window_size, interpolation=cv2.INTER_NEAREST)
+  star_location = (int((star_location[0] + 0.5) * scale_x),
+                   int((star_location[1] + 0.5) * scale_y))
+
+  # Draw a crosshair and circle around the star
+  cv2.drawMarker(zoomed_img, star_location, (0, 0, 255), cv2.MARKER_CROSS, 10, 2)
+  if fwhm:
+    cv2.circle(zoomed_img, star_location, int(fwhm * scale_x) // 2, (0, 0, 255), 2)
+
+  # Overlay the laplacian and FWHM values on the image, on the pre-rendered
+  # labels and black box behind them.
+  zoomed_img[0:25, 0:300] = LAPLACIAN_LABEL
+  cv2.putText(zoomed_img, f'{laplacian:9.3f}', (LABEL_WIDTH, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2, cv2.LINE_AA)
+  if fwhm:
+    fwhm = float(fwhm)
+    zoomed_img[25:50, 0:300] = FWHM_LABEL
+    cv2.putText(zoomed_img, f'{fwhm:9.3f}', (LABEL_WIDTH, 45), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255), 2, cv2.LINE_AA)
+
+  if fwhm:
+    print(f'Laplacian: {laplacian:9.3f} | FWHM: {fwhm:9.3f}')
+  else:
+    print(f'Laplacian: {laplacian:9.3f} | FWHM: None')
+  return zoomed_img, laplacian, fwhm
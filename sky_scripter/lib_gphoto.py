@@ -25,6 +25,9 @@ class GphotoClient:
     self.mode = mode
     self.iso = iso
     self.shutter_speed = shutter_speed
+    # Settings last written to the camera, used to skip redundant --set-config
+    # flags: every gphoto2 invocation re-opens the PTP session.
+    self.applied_settings = {}
 
   def set_config(self, settings: dict):
     if self.simulate:
@@ -34,6 +37,18 @@ class GphotoClient:
       command.append('--set-config')
       command.append(f'{key}="{value}"')
     exec_or_fail(command)
+    self.applied_settings.update(settings)
+
+  def pending_config(self, settings: dict) -> list:
+    # Return the --set-config flags for the settings that differ from the ones
+    # last applied to the camera.
+    flags = []
+    for key, value in settings.items():
+      if value is None or self.applied_settings.get(key) == value:
+        continue
+      flags.append('--set-config')
+      flags.append(f'{key}={value}')
+    return flags
 
   '''
   Initialize the camera with the provided image format and mode.
@@ -43,12 +58,14 @@ class GphotoClient:
   def initialize(self):
     if self.simulate:
       return
-    self.set_config({'/main/capturesettings/autoexposuremodedial': self.mode})
-    self.set_config({'/main/imgsettings/imageformat': self.image_format})
+    # Write all settings in a single gphoto2 invocation.
+    settings = {'/main/capturesettings/autoexposuremodedial': self.mode,
+                '/main/imgsettings/imageformat': self.image_format}
     if self.iso is not None:
-      self.set_config({'iso': self.iso})
+      settings['iso'] = self.iso
     if self.shutter_speed is not None and self.mode == 'Manual':
-      self.set_config({'shutterspeed': self.shutter_speed})
+      settings['shutterspeed'] = self.shutter_speed
+    self.set_config(settings)
 
   def capture_image(self, 
                     filename: str, 
@@ -74,26 +91,25 @@ class GphotoClient:
         shutil.copy('sample_data/NGC2244.cr3', filename)
       return
 
-    command = ['gphoto2']
-    if iso is not None:
-      command.append('--set-config')
-      command.append(f'iso={iso}')
-    if shutter_speed is not None:
-      command.append('--set-config')
-      command.append(f'shutterspeed={shutter_speed}')
-    if image_format is not None:
-      command.append('--set-config')
-      command.append(f'/main/imgsettings/imageformat={image_format}')
+    # Only send the settings that changed since they were last applied.
+    settings = {'iso': iso,
+                'shutterspeed': shutter_speed,
+                '/main/imgsettings/imageformat': image_format}
+    command = ['gphoto2'] + self.pending_config(settings)
     if self.mode == 'Manual':
       command += ['--capture-image-and-download', 
                   '--filename', 
                   filename, 
                   '--force-overwrite']
-      exec_or_fail(command)
+      exec_or_fail(command, capture_stdout=False)
+      self.applied_settings.update(
+          {k: v for k, v in settings.items() if v is not None})
     elif self.mode == 'Bulb':
       # First, write any specified configuration to the camera.
       if len(command) > 1:
         exec_or_fail(command)
+        self.applied_settings.update(
+            {k: v for k, v in settings.items() if v is not None})
       if type(shutter_speed) == str:
         shutter_decimal = eval(shutter_speed)
       elif type(shutter_speed) == int or type(shutter_speed) == float:
@@ -109,7 +125,42 @@ class GphotoClient:
                  '--filename', filename,
                  '--force-overwrite'] 
       # print(command)
-      exec_or_fail(command)
+      exec_or_fail(command, capture_stdout=False)
     else:
       logging.error(f"Unknown mode '{self.mode}' for capturing image.")
-    
\ No newline at end of file
+    
+  def capture_image_bytes(self,
+                          iso: int | None = None,
+                          shutter_speed: str | float | None = None) -> bytes:
+    '''
+    Capture an image in Manual mode and return the contents of the image file,
+    without writing it to disk.
+    '''
+    if self.simulate:
+      if shutter_speed is None:
+        shutter_speed = self.shutter_speed
+      if type(shutter_speed) == str:
+        shutter_speed = eval(shutter_speed)
+      time.sleep((shutter_speed or 0) + 2)
+      if self.image_format == 'RAW':
+        sample_file = 'sample_data/NGC2244.cr3'
+      else:
+        sample_file = 'sample_data/NGC2244.jpg'
+      with open(sample_file, 'rb') as f:
+        return f.read()
+
+    if self.mode != 'Manual':
+      logging.error(f"Capturing to memory is not supported in mode '{self.mode}'.")
+      return None
+    settings = {'iso': iso, 'shutterspeed': shutter_speed}
+    command = ['gphoto2'] + self.pending_config(settings) + \
+        ['--capture-image-and-download', '--stdout']
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+      logging.error("command '%s' returned %d" % (command, result.returncode))
+      logging.error(result.stderr.decode(errors='replace'))
+      print("command '%s' returned %d" % (command, result.returncode))
+      sys.exit(1)
+    self.applied_settings.update(
+        {k: v for k, v in settings.items() if v is not None})
+    return result.stdout
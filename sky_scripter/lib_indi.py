@@ -3,9 +3,6 @@ import subprocess
 import sys
 import time
 import logging
-from astropy.coordinates import SkyCoord, EarthLocation, AltAz
-from astropy.time import Time
-import astropy.units as u
 
 from typing import Tuple, Literal
 
@@ -27,7 +24,7 @@ class IndiClient:
     lines = output.splitlines()
     if len(lines) == 1:
       # Parse the output to get the property value.
-      output = output.split("=")[1].strip()
+      output = output.partition("=")[2].strip()
       return output
     else:
       # Parse the output from each line to get all property values.
@@ -36,11 +33,25 @@ class IndiClient:
         # Get key-value pair.
         # Example:"SkyAdventurer GTi.RASTATUS.RAInitialized=Ok"
         # Key="RAInitialized" Value="Ok"
-        key = line.split("=")[0].split(".")[-1]
-        value = line.split("=")[1].strip()
-        output.append((key, value))
+        name, _, value = line.partition("=")
+        output.append((name.rpartition(".")[2], value.strip()))
       return output
 
+  def read_vector(self, vector: str, timeout: float = 2) -> dict:
+    # Read all the elements of a property vector with a single indi_getprop
+    # call, as a dict from element name to value.
+    output = self.read(vector + ".*", timeout)
+    if not isinstance(output, list):
+      return {}
+    return dict(output)
+
+  def read_switch(self, vector: str, timeout: float = 2) -> str | None:
+    # Returns the name of the switch of the vector that is On, if any.
+    for key, value in self.read_vector(vector, timeout).items():
+      if value == "On":
+        return key
+    return None
+
   def write(self, propname: str, keys: list | str, values: list | str):
     if self.simulate:
       return
@@ -199,12 +210,9 @@ class IndiMount(IndiClient):
       logging.error(f"Sync failed. Requested: {ra} {dec} Read: {ra_read} {dec_read}")
 
   def get_tracking_state(self) -> Literal["TRACK_ON", "TRACK_OFF", "Unknown"]:
-    track_state_on = self.read("TELESCOPE_TRACK_STATE.TRACK_ON")
-    track_state_off = self.read("TELESCOPE_TRACK_STATE.TRACK_OFF")
-    if track_state_on == "On":
-      return "TRACK_ON"
-    elif track_state_off == "On":
-      return "TRACK_OFF"
+    track_state = self.read_switch("TELESCOPE_TRACK_STATE")
+    if track_state in ["TRACK_ON", "TRACK_OFF"]:
+      return track_state
     else:
       logging.error("Get tracking state: unknown state")
       return "Unknown"
@@ -220,19 +228,12 @@ class IndiMount(IndiClient):
                                          "TRACK_SOLAR",
                                          "TRACK_CUSTOM",
                                          "Unknown"]:
-    sidereal_tracking = self.read("TELESCOPE_TRACK_MODE.TRACK_SIDEREAL")
-    lunar_tracking = self.read("TELESCOPE_TRACK_MODE.TRACK_LUNAR")
-    solar_tracking = self.read("TELESCOPE_TRACK_MODE.TRACK_SOLAR")
-    custom_tracking = self.read("TELESCOPE_TRACK_MODE.TRACK_CUSTOM")
-
-    if sidereal_tracking == "On":
-      return "TRACK_SIDEREAL"
-    elif lunar_tracking == "On":
-      return "TRACK_LUNAR"
-    elif solar_tracking == "On":
-      return "TRACK_SOLAR"
-    elif custom_tracking == "On":
-      return "TRACK_CUSTOM"
+    tracking_mode = self.read_switch("TELESCOPE_TRACK_MODE")
+    if tracking_mode in ["TRACK_SIDEREAL",
+                         "TRACK_LUNAR",
+                         "TRACK_SOLAR",
+                         "TRACK_CUSTOM"]:
+      return tracking_mode
     else:
       logging.error("Get tracking mode: unknown mode")
       return "Unknown"
@@ -256,6 +257,9 @@ class IndiMount(IndiClient):
     return ra, dec
 
   def get_alt_az(self) -> Tuple[float, float]:
+    from astropy.time import Time
+    from astropy.coordinates import SkyCoord, EarthLocation, AltAz
+    import astropy.units as u
     ra, dec = self.get_ra_dec()
     obs_time = Time.now()
     lat = float(self.read("GEOGRAPHIC_COORD.LAT"))
@@ -282,9 +286,10 @@ class IndiMount(IndiClient):
     return alt, az
 
   def get_pier_side(self) -> Literal["West", "East", "Unknown"]:
-    if self.read("TELESCOPE_PIER_SIDE.PIER_WEST") == "On":
+    pier_side = self.read_switch("TELESCOPE_PIER_SIDE")
+    if pier_side == "PIER_WEST":
       return "West"
-    elif self.read("TELESCOPE_PIER_SIDE.PIER_EAST") == "On":
+    elif pier_side == "PIER_EAST":
       return "East"
     else:
       logging.error("Could not determine pier side")
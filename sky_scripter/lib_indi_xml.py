@@ -0,0 +1,77 @@
+import logging
+import socket
+import time
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import quoteattr
+
+# Kept apart from lib_indi, which imports sky_scripter.util, so that scripts
+# that only read INDI properties do not need ASTAP, numpy or Siril.
+
+class IndiXmlClient:
+  '''
+  Reads device properties over a persistent connection to the INDI server,
+  instead of running indi_getprop for every read. The latest value of every
+  property reported by the server is cached.
+  '''
+  def __init__(self, device: str, host: str = 'localhost', port: int = 7624):
+    self.device = device
+    self.values = {}
+    self.socket = socket.create_connection((host, port))
+    self.parser = ElementTree.XMLPullParser(['start', 'end'])
+    # The server sends a stream of top-level elements: wrap them in a root
+    # element so that they parse as a single document.
+    self.parser.feed(b'<indi>')
+    self.root = None
+    self.request()
+
+  def request(self, vector: str | None = None):
+    # Ask the server to send the current values of a property vector, or of
+    # all the properties of the device. Cached values of the vector are
+    # dropped, so that the next read waits for the fresh ones.
+    message = '<getProperties version="1.7" device=%s' % quoteattr(self.device)
+    if vector is not None:
+      message += ' name=%s' % quoteattr(vector)
+      for key in [k for k in self.values if k.startswith(vector + '.')]:
+        del self.values[key]
+    self.socket.sendall((message + '/>').encode())
+
+  def update(self, timeout: float = 0):
+    # Parse the messages received from the server, waiting up to timeout
+    # seconds for the first one.
+    self.socket.settimeout(timeout)
+    while True:
+      try:
+        data = self.socket.recv(65536)
+      except (BlockingIOError, socket.timeout):
+        break
+      if not data:
+        raise ConnectionError("INDI server closed the connection")
+      self.parser.feed(data)
+      self.socket.setblocking(False)
+    for event, element in self.parser.read_events():
+      if event == 'start':
+        if self.root is None:
+          self.root = element
+        continue
+      if element.tag.endswith('Vector') and \
+          element.get('device') == self.device:
+        for child in element:
+          self.values[element.get('name') + '.' + child.get('name')] = \
+              (child.text or '').strip()
+      if element in self.root:
+        # Drop processed messages, so that the document does not grow.
+        self.root.remove(element)
+
+  def read(self, propname: str, timeout: float = 2) -> str | None:
+    self.update()
+    t_end = time.time() + timeout
+    while propname not in self.values:
+      remaining = t_end - time.time()
+      if remaining <= 0:
+        logging.error(f"Timeout reading property '{propname}' from device '{self.device}'")
+        return None
+      self.update(remaining)
+    return self.values[propname]
+
+  def close(self):
+    self.socket.close()
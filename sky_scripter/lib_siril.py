@@ -0,0 +1,37 @@
+import functools
+import os
+import shutil
+import subprocess
+
+# Extracted Siril AppImages, by AppImage file name.
+SIRIL_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                               'skyscripter', 'siril')
+
+@functools.lru_cache(maxsize=None)
+def siril_executable(siril_path):
+  # Running an AppImage mounts it with FUSE on every invocation, which adds
+  # to the startup time of each Siril run. Extract it once, and run the
+  # extracted AppRun instead. The AppImage is extracted again when it changes.
+  # Any other path, e.g. the macOS app, is returned as is. The result is
+  # cached, since scripts resolve the path before every Siril run.
+  if not siril_path.endswith('.AppImage') or not os.path.exists(siril_path):
+    return siril_path
+  extract_dir = os.path.join(SIRIL_CACHE_DIR, os.path.basename(siril_path))
+  apprun = os.path.join(extract_dir, 'squashfs-root', 'AppRun')
+  stamp_file = os.path.join(extract_dir, 'mtime')
+  stamp = str(os.path.getmtime(siril_path))
+  try:
+    with open(stamp_file) as f:
+      if f.read() == stamp and os.path.exists(apprun):
+        return apprun
+  except OSError:
+    pass
+  shutil.rmtree(extract_dir, ignore_errors=True)
+  os.makedirs(extract_dir)
+  result = subprocess.run([siril_path, '--appimage-extract'], cwd=extract_dir,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  if result.returncode != 0 or not os.path.exists(apprun):
+    return siril_path
+  with open(stamp_file, 'w') as f:
+    f.write(stamp)
+  return apprun
@@ -4,13 +4,18 @@ import sys
 import os
 import time
 import re
-import shutil
-import tempfile
-from astroquery.simbad import Simbad
-from astropy.coordinates import SkyCoord, FK5, ICRS
-import astropy.units as units
-import astropy.time
+import sqlite3
+import math
+import functools
+import contextlib
+import numpy as np
 
+from sky_scripter.lib_siril import siril_executable
+
+# Siril findstar summary, e.g.:
+# Found 343 Gaussian profile stars in image, channel #0 (FWHM 5.428217)
+SIRIL_FINDSTAR_REGEX = re.compile(
+    r"Found ([0-9]+) [a-z,A-Z]* profile stars in image, channel #[0-9] \(FWHM ([0-9]+\.[0-9]+)\)")
 
 def init_logging(name, also_to_console=False):
   script_dir = os.path.dirname(__file__)
@@ -36,12 +41,15 @@ def print_and_log(message, level=logging.INFO):
   print(message)
   logging.log(level, message)
 
-def exec_or_fail(command, allowed_return_codes=[0]):
+def exec_or_fail(command, allowed_return_codes=[0], capture_stdout=True):
   # Concatenate the command into a single string
   if type(command) == list:
     command = ' '.join(command)
   # print(f"Executing command: {command}")
-  result = subprocess.run(command, capture_output=True, text=True, shell=True)
+  # When the output is not needed, discard stdout instead of buffering it.
+  stdout = subprocess.PIPE if capture_stdout else subprocess.DEVNULL
+  result = subprocess.run(command, stdout=stdout, stderr=subprocess.PIPE,
+                          text=True, shell=True)
   if result.stderr:
     # print(f"Error running command '{command}': {result.stderr}")
     logging.error(f"stderr from running command '{command}': {result.stderr}")
@@ -54,7 +62,7 @@ def exec_or_fail(command, allowed_return_codes=[0]):
     logging.error(result.stderr)
     print("command '%s' returned %d" % (command, result.returncode))
     sys.exit(1)
-  return result.stdout
+  return result.stdout if capture_stdout else ''
 
 if sys.platform == 'darwin':
   astap_path_autodetected = '/Applications/astap.app/Contents/MacOS/astap'
@@ -62,6 +70,13 @@ else:
   # Get the path to the astap executable from `which astap`
   astap_path_autodetected = exec_or_fail('which astap').strip()
 
+# Where the ASTAP installers put the star database, e.g. d50_0101.1476.
+if sys.platform == 'darwin':
+  astap_database_dir_default = '/usr/local/opt/astap'
+else:
+  astap_database_dir_default = '/opt/astap'
+ASTAP_DATABASE_FILE_REGEX = re.compile(r'^[a-z]\d{2}_\d{4}\.\d+$')
+
 def exec_or_pass(command, allowed_return_codes=[0]):
   result = subprocess.run(command, capture_output=True, text=True)
   if result.returncode not in allowed_return_codes:
@@ -69,23 +84,114 @@ def exec_or_pass(command, allowed_return_codes=[0]):
     logging.warning(result.stderr)
   return result.stdout
 
-def lookup_object_coordinates(object_name):
-    # Query the object from Simbad.
-    result_table = Simbad.query_object(object_name)
+SIMBAD_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'skyscripter', 'simbad.sqlite')
+# Maximum age of cached Simbad results, in days.
+SIMBAD_CACHE_TTL = 365
+
+def open_simbad_cache():
+  os.makedirs(os.path.dirname(SIMBAD_CACHE_FILE), exist_ok=True)
+  db = sqlite3.connect(SIMBAD_CACHE_FILE)
+  try:
+    db.execute('CREATE TABLE IF NOT EXISTS objects '
+               '(name TEXT PRIMARY KEY, ra_deg REAL, dec_deg REAL, ts REAL)')
+  except sqlite3.Error:
+    db.close()
+    raise
+  return db
+
+def query_simbad_icrs(object_name, use_cache=True):
+  # Returns the ICRS (J2000) coordinates of the object as a SkyCoord, using
+  # the on-disk cache to skip the Simbad network round-trip when possible.
+  # astropy and astroquery are imported here, and not at the top of the
+  # module, since importing them takes most of a second and many scripts
+  # never need them.
+  from astropy.coordinates import SkyCoord, ICRS
+  import astropy.units as units
+  key = ' '.join(object_name.upper().split())
+  if use_cache:
+    try:
+      with contextlib.closing(open_simbad_cache()) as db:
+        row = db.execute('SELECT ra_deg, dec_deg, ts FROM objects WHERE name = ?',
+                         (key,)).fetchone()
+      if row is not None and time.time() - row[2] < SIMBAD_CACHE_TTL * 86400:
+        logging.info(f"Using cached Simbad coordinates for '{object_name}'")
+        return SkyCoord(row[0], row[1], unit=(units.deg, units.deg), frame=ICRS())
+    # The cache only saves time: fall back to querying Simbad if it cannot
+    # be used, e.g. with a read-only home directory.
+    except (sqlite3.Error, OSError) as e:
+      logging.warning(f"Unable to read Simbad cache: {e}")
+
+  # Query the object from Simbad.
+  from astroquery.simbad import Simbad
+  result_table = Simbad.query_object(object_name)
+
+  if result_table is None:
+      logging.error(f"ERROR: Unable to find object '{object_name}'")
+      print(f"ERROR: Unable to find object '{object_name}'")
+      sys.exit(1)
+  # Extract RA and DEC
+  ra = result_table['RA'][0]
+  dec = result_table['DEC'][0]
+  c = SkyCoord(ra, dec, unit=(units.hourangle, units.deg), frame=ICRS())
+
+  try:
+    with contextlib.closing(open_simbad_cache()) as db:
+      db.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)',
+                 (key, c.ra.deg, c.dec.deg, time.time()))
+      db.commit()
+  except (sqlite3.Error, OSError) as e:
+    logging.warning(f"Unable to write Simbad cache: {e}")
+  return c
+
+@functools.lru_cache(maxsize=4)
+def jnow_rotation(minute):
+  # ICRS to FK5(equinox=now) is a pure rotation (frame bias and precession).
+  # Build its matrix by transforming the three ICRS basis vectors. Precession
+  # moves coordinates by ~50 arcseconds per year, so the matrix is computed at
+  # most once a minute.
+  from astropy.coordinates import SkyCoord, FK5, ICRS
+  import astropy.units as units
+  import astropy.time
+  basis = SkyCoord([0, 90, 0], [0, 0, 90], unit=(units.deg, units.deg),
+                   frame=ICRS())
+  equinox = astropy.time.Time(minute * 60, format='unix')
+  return basis.transform_to(FK5(equinox=equinox)).cartesian.xyz.value
 
-    if result_table is None:
-        logging.error(f"ERROR: Unable to find object '{object_name}'")
-        print(f"ERROR: Unable to find object '{object_name}'")
-        sys.exit(1)
-    # Extract RA and DEC
-    ra = result_table['RA'][0]
-    dec = result_table['DEC'][0]
+def icrs_to_jnow(ra_deg, dec_deg):
+  # Returns JNow RA in hours and DEC in degrees.
+  ra, dec = math.radians(ra_deg), math.radians(dec_deg)
+  v = np.dot(jnow_rotation(int(time.time() // 60)),
+             [math.cos(dec) * math.cos(ra),
+              math.cos(dec) * math.sin(ra),
+              math.sin(dec)])
+  ra_jnow = math.degrees(math.atan2(v[1], v[0])) % 360
+  dec_jnow = math.degrees(math.asin(max(-1, min(1, v[2]))))
+  return ra_jnow / 15, dec_jnow
+
+def lookup_object_coordinates(object_name, use_cache=True):
+    c = query_simbad_icrs(object_name, use_cache)
 
     # Convert J2000 coordinates to JNow.
-    c = SkyCoord(ra, dec, unit=(units.hourangle, units.deg), frame=ICRS())
-    jnow_coord = c.transform_to(FK5(equinox=astropy.time.Time.now()))
+    return icrs_to_jnow(c.ra.deg, c.dec.deg)
+
+def format_sexagesimal(value):
+  # Format an angle in hours or degrees as [-]HH:MM:SS.SS without building an
+  # astropy Angle, which is slow for per-iteration logging.
+  total = round(abs(value) * 3600, 2)
+  h, rem = divmod(total, 3600)
+  m, s = divmod(rem, 60)
+  sign = '-' if value < 0 else ''
+  return f"{sign}{int(h):02d}:{int(m):02d}:{s:05.2f}"
 
-    return jnow_coord.ra.hour, jnow_coord.dec.deg
+def parse_sexagesimal(value):
+  # Parse [-]HH:MM:SS.SS or [-]DD:MM:SS.SS (or a decimal value) into decimal
+  # hours or degrees, without going through astropy.
+  parts = value.strip().split(':')
+  result = 0
+  for i, part in enumerate(parts):
+    result += abs(float(part)) / 60**i
+  return -result if value.strip().startswith('-') else result
 
 def parse_coordinates(args, parser):
   if args.object is None and args.wcs is None:
@@ -98,101 +204,141 @@ def parse_coordinates(args, parser):
     sys.exit(1)
   if args.object is not None:
     logging.info(f"Looking up coordinates for object '{args.object}'")
-    coordinates = lookup_object_coordinates(args.object)
-    # Print WCS coordinates in 6 decimal places
-    c = SkyCoord(coordinates[0], coordinates[1], unit=(units.hourangle, units.deg))
-    coordinates_string = c.to_string('hmsdms', precision=0, sep=':')
+    use_cache = not getattr(args, 'no_cache', False)
+    coordinates = lookup_object_coordinates(args.object, use_cache)
+    coordinates_string = format_sexagesimal(coordinates[0]) + ' ' + \
+        format_sexagesimal(coordinates[1])
     print_and_log(f"Using WCS coordinates of '{args.object}': {coordinates_string}")
   else:
     print_and_log(f"Using WCS coordinates: {args.wcs}")
-    coordinates = args.wcs.split()
-    # Convert coordinates to RA and DEC in decimal degrees.
-    ra, dec = coordinates
-    c = SkyCoord(ra, dec, unit=(units.hour, units.deg))
-    # print("Provided: %s %s Interpreted: %f %f" % (ra, dec, c.ra.hour, c.dec.deg))
-    # sys.exit(1)
-    coordinates = c.ra.hour, c.dec.deg
+    # Convert coordinates to RA in decimal hours and DEC in decimal degrees.
+    ra, dec = args.wcs.split()
+    coordinates = parse_sexagesimal(ra), parse_sexagesimal(dec)
   return coordinates
 
-def run_plate_solve_astap(file, astap_path=astap_path_autodetected):
-  astap_cli_command = [astap_path + " -f " + file + " -r 180"]
-  astap_output = exec_or_fail(astap_cli_command)
-  # Define the regex pattern, to match output like this:
-  # Solution found: 05: 36 03.8	-05° 27 14
-  regex = r"Solution found: ([\ ]*[0-9]+): ([\ ]*[0-9]+) ([\ ]*[0-9]+\.[0-9]+)\t([+-])([\ ]*[0-9]+)° ([\ ]*[0-9]+) ([\ ]*[0-9]+\.[0-9]+)"
-  # print(f"ASTAP output:\n {astap_output}\n========\n")
-  # Search for the pattern in the output
-  match = re.search(regex, astap_output)
-  if not match:
-    logging.warning("No plate solve solution found in ASTAP output:")
-    logging.warning(astap_output)
+def read_astap_solution(solution_file):
+  # ASTAP writes its result next to the image as <name>.ini, with lines like
+  # PLTSOLVD=T, CRVAL1=<RA in degrees>, CRVAL2=<DEC in degrees>.
+  # Returns RA in hours and DEC in degrees, or None, None if not solved.
+  if not os.path.exists(solution_file):
     return None, None
+  values = {}
+  with open(solution_file) as f:
+    for line in f:
+      key, _, value = line.partition('=')
+      values[key.strip()] = value.strip()
+  if values.get('PLTSOLVD') != 'T' or \
+      'CRVAL1' not in values or 'CRVAL2' not in values:
+    return None, None
+  return float(values['CRVAL1']) / 15, float(values['CRVAL2'])
 
-  # Extract matched groups
-  alpha_h, alpha_m, alpha_s, delta_sign, delta_d, delta_m, delta_s = match.groups()
-
-  # Convert alpha (RA) to decimal degrees
-  alpha = float(alpha_h) + float(alpha_m)/60 + float(alpha_s)/3600
-
-  # Convert delta (DEC) to decimal degrees
-  delta_multiplier = 1 if delta_sign == '+' else -1
-  delta = delta_multiplier * (float(delta_d) + float(delta_m)/60 + float(delta_s)/3600)
-
-  if False:
-    print(f"RA: {alpha}, DEC: {delta}")
-
-  # TODO: Convert J2000 coordinates to JNow.
-  c = SkyCoord(alpha, delta, unit=(units.hourangle, units.deg), frame=ICRS())
-  jnow_coord = c.transform_to(FK5(equinox=astropy.time.Time.now()))
+@functools.lru_cache(maxsize=None)
+def prefetch_astap_database(database_dir=astap_database_dir_default):
+  # ASTAP re-reads its star database on every invocation. Ask the kernel to
+  # load the database files into the page cache, once per run, so that
+  # repeated solves do not wait on disk reads. Skipped if the database would
+  # take up more than a quarter of the free memory, and on MacOS, which has
+  # no posix_fadvise.
+  if not hasattr(os, 'posix_fadvise'):
+    return
+  try:
+    with os.scandir(database_dir) as entries:
+      database_files = [entry for entry in entries
+                        if ASTAP_DATABASE_FILE_REGEX.match(entry.name)]
+    database_size = sum(entry.stat().st_size for entry in database_files)
+    free_memory = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+  except (OSError, ValueError):
+    return
+  if not database_files or database_size > free_memory / 4:
+    return
+  for entry in database_files:
+    try:
+      fd = os.open(entry.path, os.O_RDONLY)
+      try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+      finally:
+        os.close(fd)
+    except OSError as e:
+      logging.warning(f"Unable to prefetch ASTAP database file {entry.name}: {e}")
 
-  alpha = jnow_coord.ra.hour
-  delta = jnow_coord.dec.deg
+def run_plate_solve_astap(file,
+                          ra_hint=None,
+                          dec_hint=None,
+                          radius=180,
+                          fov=None,
+                          downsample=None,
+                          astap_path=astap_path_autodetected):
+  # Hints: ra_hint in hours, dec_hint in degrees, search radius and field of
+  # view in degrees. A narrow search around a known position is much faster
+  # than a blind solve.
+  astap_cli_command = [astap_path + " -f " + file + " -r %g" % radius]
+  if ra_hint is not None and dec_hint is not None:
+    # ASTAP takes the declination as south pole distance.
+    astap_cli_command.append("-ra %f -spd %f" % (ra_hint, dec_hint + 90))
+  if fov is not None:
+    astap_cli_command.append("-fov %f" % fov)
+  if downsample is not None:
+    astap_cli_command.append("-z %d" % downsample)
+  # Remove any stale solution from a previous solve of the same file, so that
+  # it cannot be mistaken for the result of this solve.
+  base = os.path.splitext(file)[0]
+  for ext in ('.ini', '.wcs'):
+    if os.path.exists(base + ext):
+      os.remove(base + ext)
+  # ASTAP returns 1 if no solution was found.
+  exec_or_fail(astap_cli_command, allowed_return_codes=[0, 1],
+               capture_stdout=False)
+  # ASTAP writes the .wcs file only when the solve succeeds.
+  if not os.path.exists(base + '.wcs'):
+    logging.warning(f"No plate solve solution found for {file}")
+    return None, None
+  alpha, delta = read_astap_solution(base + '.ini')
+  if alpha is None or delta is None:
+    logging.warning(f"Unable to read plate solve solution for {file}")
+    return None, None
 
-  return alpha, delta
+  # Convert J2000 coordinates to JNow.
+  return icrs_to_jnow(alpha * 15, delta)
 
 
 def run_star_detect_siril(image_file):
-  with tempfile.TemporaryDirectory() as tmpdirname:
-    shutil.copy(image_file, tmpdirname)
-    # If MacOS, use the Siril.app version
-    if sys.platform == 'darwin':
-      SIRIL_PATH = '/Applications/Siril.app/Contents/MacOS/Siril'
-    else:
-      SIRIL_PATH = '/home/joydeepb/Downloads/Siril-1.2.5-x86_64.AppImage'
-    siril_commands = f"""requires 1.2.0
-convert light
-# calibrate_single light_00001 -bias="=2048" -debayer -cfa -equalize_cfa
-# load pp_light_00001
-# crop 2048 1366 4096 2732
-load light_00001
+  # If MacOS, use the Siril.app version
+  if sys.platform == 'darwin':
+    SIRIL_PATH = '/Applications/Siril.app/Contents/MacOS/Siril'
+  else:
+    SIRIL_PATH = siril_executable('/home/joydeepb/Downloads/Siril-1.2.5-x86_64.AppImage')
+  # Load the image in place: converting it into a sequence first would copy
+  # and re-write the full image on every call.
+  image_dir = os.path.dirname(os.path.abspath(image_file))
+  siril_commands = f"""requires 1.2.0
+load {os.path.basename(image_file)}
 setfindstar -radius=3 -sigma=0.5 -roundness=0.8 -focal=403.2 -pixelsize=4.39 -moffat -minbeta=1.5 -relax=on
 findstar
 close
 """
-    # Define the command to run
-    siril_cli_command = [SIRIL_PATH, "-d", tmpdirname, "-s", "-"]
-    # Run the command and capture output
-    try:
-      result = subprocess.run(siril_cli_command,
-                              input=siril_commands,
-                              text=True,
-                              capture_output=True,
-                              check=True)
-      if result.returncode != 0:
-        print("Error running Siril.")
-        exit(1)
-      # print(result.stdout)
-      # Extract the number of stars detected, and the FWHM. Sample output:
-      # Found 343 Gaussian profile stars in image, channel #0 (FWHM 5.428217)
-      regex = r"Found ([0-9]+) [a-z,A-Z]* profile stars in image, channel #[0-9] \(FWHM ([0-9]+\.[0-9]+)\)"
-      match = re.search(regex, result.stdout)
-      if not match:
-        return None, None
-      num_stars, fwhm = match.groups()
-      if float(fwhm) < 0 or int(num_stars) < 0 or float(fwhm) > 10:
-        print_and_log(f"WARNING: Invalid FWHM and number of stars: {fwhm}, {num_stars}", level=logging.WARNING)
-        print_and_log(f"Full output:\n {result.stdout}\n", level=logging.WARNING)
-      # print(f"Detected '{num_stars}' stars with FWHM '{fwhm}' full output:\n {result.stdout}\n")
-      return int(num_stars), float(fwhm)
-    except subprocess.CalledProcessError as e:
-      return None, None
\ No newline at end of file
+  # Define the command to run
+  siril_cli_command = [SIRIL_PATH, "-d", image_dir, "-s", "-"]
+  # Run the command and capture output
+  try:
+    result = subprocess.run(siril_cli_command,
+                            input=siril_commands,
+                            text=True,
+                            capture_output=True,
+                            check=True)
+    if result.returncode != 0:
+      print("Error running Siril.")
+      exit(1)
+    # print(result.stdout)
+    # Extract the number of stars detected, and the FWHM. Sample output:
+    # Found 343 Gaussian profile stars in image, channel #0 (FWHM 5.428217)
+    match = SIRIL_FINDSTAR_REGEX.search(result.stdout)
+    if not match:
+      return None, None
+    num_stars, fwhm = match.groups()
+    if float(fwhm) < 0 or int(num_stars) < 0 or float(fwhm) > 10:
+      print_and_log(f"WARNING: Invalid FWHM and number of stars: {fwhm}, {num_stars}", level=logging.WARNING)
+      print_and_log(f"Full output:\n {result.stdout}\n", level=logging.WARNING)
+    # print(f"Detected '{num_stars}' stars with FWHM '{fwhm}' full output:\n {result.stdout}\n")
+    return int(num_stars), float(fwhm)
+  except subprocess.CalledProcessError as e:
+    return None, None
\ No newline at end of file